@@ -1,8 +1,9 @@
 import os
 import asyncio
+import json
+import math
 import traceback
-import time
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, g
 from flask_cors import CORS
 from dotenv import load_dotenv
 
@@ -10,107 +11,398 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # 2. 從 services 模組導入核心函式
-from services import get_little_tone_final_response
+from services import get_little_tone_final_response, stream_little_tone_response, stream_batch_responses, get_knowledge_base
+from services.chat_service import BATCH_MAX_ITEMS, BATCH_TONE_MAX_CHARS, warm_up
+from services.prompts import TONE_INSTRUCTION_TEMPLATE
+from services.rate_limiter import rate_limiter, TEXT_COST, IMAGE_COST
+from services.event_loop import shared_loop
+from services import metrics
+from services.session_store import session_store, new_session_id, is_valid_session_id, turn_messages
 
-app = Flask(__name__)
+# 3. 啟動時預先載入知識庫索引，避免每次請求重新讀檔
+get_knowledge_base()
+# 4. 在背景執行緒預先建立 OpenAI 客戶端與語意索引，不拖慢啟動，也不佔用共用事件迴圈
+warm_up()
+
+class LittleToneFlask(Flask):
+    def async_to_sync(self, func):
+        # 所有 async view 都交給同一個長駐事件迴圈執行 (取代 flask[async] 每個請求開新迴圈)，
+        # 讓 OpenAI 連線池可以跨請求重用。整個 view 都會佔用事件迴圈執行緒，
+        # 因此 API 路由維持同步 view，只把呼叫上游的協程交給 shared_loop.run
+        def run(*args, **kwargs):
+            return shared_loop.run(func(*args, **kwargs))
+        return run
+
+app = LittleToneFlask(__name__)
 CORS(app)
 
 # 限制請求大小上限為 5MB
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024 
 
+# 需要逐階段計時並輸出 [Timing] 紀錄的路由
+TIMED_ROUTES = {"/api/chat": "chat", "/api/chat/stream": "chat_stream", "/api/chat/batch": "chat_batch"}
+
+@app.before_request
+def _start_request_timing():
+    route = TIMED_ROUTES.get(request.path)
+    g.timing = metrics.begin_request(route) if route else None
+
+@app.after_request
+def _finish_request_timing(response):
+    # 串流回應要等內容送完才算結束，由 generator 自行收尾
+    timing = g.get("timing")
+    if timing is not None and not response.is_streamed:
+        metrics.finish_request(timing, response.status_code)
+    return response
+
+def _get_client_ip():
+    # 取得真實 IP (優先從 Cloudflare/Vercel 的 Header 抓取)
+    return request.headers.get('X-Forwarded-For', request.remote_addr).split(',')[0]
+
+def check_rate_limit(cost=TEXT_COST, rule="chat"):
+    """
+    檢查目前請求的 IP 是否發送過於頻繁 (Token Bucket，帶圖片的請求成本較高)
+    回傳 (是否允許, 需等待秒數)
+    """
+    with metrics.stage("rate_limit"):
+        return rate_limiter.check(_get_client_ip(), rule, cost)
+
+def _check_extra_cost(ip, extra_cost, rule):
+    """驗證內容後補扣額度差額；額度不足時回傳 429 回應"""
+    if extra_cost <= 0:
+        return None
+    allowed, wait_seconds = check_rate_limit(extra_cost, rule)
+    if not allowed:
+        return _rate_limit_response(ip, wait_seconds)
+    return None
 
-user_requests = {}
+def _check_image_surcharge(ip, payload, rule="chat"):
+    """帶圖片的請求在驗證內容後補扣差額"""
+    if not payload["image"]:
+        return None
+    return _check_extra_cost(ip, IMAGE_COST - TEXT_COST, rule)
 
-def check_rate_limit():
+def _check_batch_cost(ip, payload):
+    """批次的每一則都是一次上游呼叫：依項目數計費 (共用圖片時每則都以圖片成本計)，扣除入口已收的一則"""
+    item_cost = IMAGE_COST if payload["image"] else TEXT_COST
+    return _check_extra_cost(ip, item_cost * len(payload["items"]) - TEXT_COST, "batch")
+
+def _rate_limit_response(ip, wait_seconds):
+    wait_time = max(1, math.ceil(wait_seconds))
+    print(f"[Security] Rate Limit 觸發: {ip} (需等待 {wait_time}s)")
+    metrics.rate_limited_total.inc(route=TIMED_ROUTES.get(request.path, request.path))
+    return jsonify({
+        "status": "error",
+        "message": f"哎呀，你點太快了啦！LittleTone 還在努力思考中... 🍵 請等 {wait_time} 秒後再試一次喔！",
+        "error_type": "rate_limit"
+    }), 429
+
+def _validate_chat_payload():
     """
-    檢查目前請求的 IP 是否發送過於頻繁
+    [第二、三道防線] 內容驗證與 Base64 長度檢查。
+    回傳 (payload, None) 或 (None, 錯誤回應)。
     """
-    # 取得真實 IP (考慮到 Vercel/Cloudflare 轉發)
-    ip = request.headers.get('X-Forwarded-For', request.remote_addr).split(',')[0]
-    current_time = time.time()
-    
-    # 設定限制：同一 IP 必須間隔 5 秒才能發送下一次
-    LIMIT_SECONDS = 5
-    
-    if ip in user_requests:
-        last_request_time = user_requests[ip]
-        if current_time - last_request_time < LIMIT_SECONDS:
-            return False, LIMIT_SECONDS - (current_time - last_request_time)
-            
-    # 更新請求時間
-    user_requests[ip] = current_time
-    return True, 0
+    with metrics.stage("parse"):
+        data = request.get_json(silent=True)
+    if not data:
+        return None, (jsonify({"status": "error", "message": "無效的請求內容"}), 400)
+
+    user_text = data.get('message', '')
+    image_base64 = data.get('image', None)
+    chat_history = data.get('history', [])
+    # Session 模式 (選用)：帶 session_id 或 "session": true 時，對話紀錄改由伺服器保存
+    session_id = data.get('session_id')
+    use_session = bool(session_id) or data.get('session') is True
+
+    if not user_text and not image_base64:
+        return None, (jsonify({"status": "error", "message": "請提供文字訊息或圖片截圖"}), 400)
+
+    image_error = _check_image_size(image_base64)
+    if image_error:
+        return None, image_error
+
+    payload = {"message": user_text, "image": image_base64, "history": chat_history, "session_id": None}
+    if use_session:
+        _attach_session(payload, session_id)
+    return payload, None
+
+def _check_image_size(image_base64):
+    if image_base64 and len(image_base64) > 4 * 1024 * 1024:
+        print(f"[Security] 攔截過大的 Base64 請求 (長度: {len(image_base64)})")
+        return jsonify({"status": "error", "message": "圖片檔案過大，請選擇較小的截圖"}), 413
+    return None
+
+def _validate_batch_payload():
+    """
+    批次請求的內容驗證：items 為多則訊息 (字串或 {"id", "message"})，
+    或以 tones 指定多個語氣變體；image / history / session 由所有項目共用。
+    回傳 (payload, None) 或 (None, 錯誤回應)。
+    """
+    with metrics.stage("parse"):
+        data = request.get_json(silent=True)
+    if not data:
+        return None, (jsonify({"status": "error", "message": "無效的請求內容"}), 400)
+
+    raw_items = data.get('items') or []
+    tones = data.get('tones') or []
+    if not isinstance(raw_items, list) or not isinstance(tones, list):
+        return None, (jsonify({"status": "error", "message": "items 與 tones 必須是陣列"}), 400)
+    if not all(isinstance(tone, str) and tone.strip() and len(tone) <= BATCH_TONE_MAX_CHARS for tone in tones):
+        return None, (jsonify({"status": "error", "message": f"語氣名稱需為 1~{BATCH_TONE_MAX_CHARS} 字的文字"}), 400)
+
+    items = []
+    for index, item in enumerate(raw_items):
+        if isinstance(item, dict):
+            items.append({"id": item.get('id', index), "message": item.get('message', '')})
+        else:
+            items.append({"id": index, "message": item})
+    for tone in tones:
+        tone = tone.strip()
+        items.append({"id": tone, "message": TONE_INSTRUCTION_TEMPLATE.format(tone=tone)})
+
+    if not items:
+        return None, (jsonify({"status": "error", "message": "請提供 items 或 tones"}), 400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, (jsonify({"status": "error", "message": f"一次最多 {BATCH_MAX_ITEMS} 則，請分批送出"}), 400)
+    if not all(isinstance(item["message"], str) and item["message"] for item in items):
+        return None, (jsonify({"status": "error", "message": "每一則都需要提供文字訊息"}), 400)
+
+    image_base64 = data.get('image', None)
+    image_error = _check_image_size(image_base64)
+    if image_error:
+        return None, image_error
+
+    payload = {
+        "message": data.get('message', ''),  # 選用：所有項目共用的情境說明 (作為 RAG 查詢)
+        "items": items,
+        "image": image_base64,
+        "history": data.get('history', []),
+        "session_id": None,
+        "stream": data.get('stream', True) is not False,
+    }
+    session_id = data.get('session_id')
+    if session_id or data.get('session') is True:
+        _attach_session(payload, session_id)
+    return payload, None
+
+def _attach_session(payload, session_id):
+    """
+    載入伺服器端保存的對話紀錄。找不到 (過期或無效) 的 Session 會改發一個新的；
+    前端若仍自行帶上 history，則以前端的為準 (相容舊版的無狀態呼叫)。
+    """
+    stored = session_store.get(session_id) if is_valid_session_id(session_id) else None
+    if stored is None:
+        session_id = new_session_id()
+        stored = []
+    payload["session_id"] = session_id
+    if not payload["history"]:
+        payload["history"] = stored
+
+def _record_session_turn(payload, result):
+    """成功的回合寫回 Session，並回傳要附在回應中的 Session 欄位"""
+    if not payload["session_id"]:
+        return {}
+    messages = turn_messages(payload["message"], bool(payload["image"]), result)
+    if messages:
+        session_store.append(payload["session_id"], messages)
+    return {"session_id": payload["session_id"]}
+
+def _log_chat_request(ip, payload):
+    # 紀錄 Log 方便 Debug
+    has_image = "有" if payload["image"] else "無"
+    session = f" | Session: {payload['session_id'][:8]}" if payload["session_id"] else ""
+    print(f"[App] 處理請求 IP: {ip} | 文字: {payload['message'][:10]}... | 歷史: {len(payload['history'])} 則 | 圖片: {has_image}{session}")
+
+def _server_error_response(e):
+    traceback.print_exc()
+    print(f"[App] 伺服器錯誤: {str(e)}")
+    # 這裡也加入一點人情味，避免噴出冷冰冰的 500 錯誤
+    return jsonify({
+        "status": "error",
+        "message": "哎呀，LittleTone 的大腦稍微斷線了... 🔌 麻煩再試一次好嗎？"
+    }), 500
 
 @app.route('/api/chat', methods=['POST'])
-async def chat_endpoint():
+def chat_endpoint():
     """
     接收前端 Payload 並回傳 AI 建議。
     整合了 Rate Limit、Base64 安全檢查與暖心安撫語。
+    限流、讀取與驗證請求內容都在請求執行緒完成，只有核心服務交給共用事件迴圈，
+    上傳緩慢的請求或 SQLite 限流交易不會卡住其他請求的串流與期限計時。
     """
     try:
         # --- [第一道防線] Rate Limit 檢查 ---
-        # 取得真實 IP (優先從 Cloudflare/Vercel 的 Header 抓取)
-        ip = request.headers.get('X-Forwarded-For', request.remote_addr).split(',')[0]
-        current_time = time.time()
-        
-        # 設定限制：同一 IP 必須間隔 5 秒才能發送下一次
-        LIMIT_SECONDS = 5
-        if ip in user_requests:
-            last_request_time = user_requests[ip]
-            if current_time - last_request_time < LIMIT_SECONDS:
-                wait_time = int(LIMIT_SECONDS - (current_time - last_request_time))
-                print(f"[Security] Rate Limit 觸發: {ip} (需等待 {wait_time}s)")
-                return jsonify({
-                    "status": "error",
-                    "message": f"哎呀，你點太快了啦！LittleTone 還在努力思考中... 🍵 請等 {wait_time} 秒後再試一次喔！",
-                    "error_type": "rate_limit"
-                }), 429
-        
-        # 更新該 IP 的請求時間
-        user_requests[ip] = current_time
-
-        # --- [第二道防線] 內容驗證 ---
-        data = request.json
-        if not data:
-            return jsonify({"status": "error", "message": "無效的請求內容"}), 400
-
-        user_text = data.get('message', '')
-        image_base64 = data.get('image', None)  
-        chat_history = data.get('history', []) 
-
-        if not user_text and not image_base64:
-            return jsonify({"status": "error", "message": "請提供文字訊息或圖片截圖"}), 400
-
-        # --- [第三道防線] Base64 字串長度檢查 ---
-        if image_base64 and len(image_base64) > 4 * 1024 * 1024:
-            print(f"[Security] 攔截過大的 Base64 請求 (長度: {len(image_base64)})")
-            return jsonify({"status": "error", "message": "圖片檔案過大，請選擇較小的截圖"}), 413
-
-        # 紀錄 Log 方便 Debug
-        has_image = "有" if image_base64 else "無"
-        print(f"[App] 處理請求 IP: {ip} | 文字: {user_text[:10]}... | 歷史: {len(chat_history)} 則 | 圖片: {has_image}")
-        
+        ip = _get_client_ip()
+        allowed, wait_seconds = check_rate_limit()
+        if not allowed:
+            return _rate_limit_response(ip, wait_seconds)
+
+        # --- [第二、三道防線] 內容驗證 ---
+        payload, error_response = _validate_chat_payload()
+        if error_response:
+            return error_response
+
+        surcharge_response = _check_image_surcharge(ip, payload)
+        if surcharge_response:
+            return surcharge_response
+
+        _log_chat_request(ip, payload)
+
         # --- 3. 呼叫核心服務 ---
-        ai_json_result = await get_little_tone_final_response(
-            user_text, 
-            image_base64, 
-            history=chat_history
-        )
+        ai_json_result = shared_loop.run(get_little_tone_final_response(
+            payload["message"],
+            payload["image"],
+            history=payload["history"]
+        ))
 
-        # 4. 回傳結果
+        # 4. 回傳結果 (Session 模式會附上 session_id)
         return jsonify({
             "status": "success",
-            "data": ai_json_result
+            "data": ai_json_result,
+            **_record_session_turn(payload, ai_json_result)
         })
 
     except Exception as e:
-        traceback.print_exc()
-        print(f"[App] 伺服器錯誤: {str(e)}")
-        # 這裡也加入一點人情味，避免噴出冷冰冰的 500 錯誤
-        return jsonify({
-            "status": "error", 
-            "message": "哎呀，LittleTone 的大腦稍微斷線了... 🔌 麻煩再試一次好嗎？"
-        }), 500
+        return _server_error_response(e)
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _iterate_async_generator(agen):
+    """在共用事件迴圈上逐步驅動 async generator，讓 Flask 能以一般 generator 串流輸出"""
+    try:
+        while True:
+            try:
+                yield shared_loop.run(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        shared_loop.run(agen.aclose())
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream_endpoint():
+    """
+    串流版本的 /api/chat (Server-Sent Events)：
+    - event: reply  -> {"delta": "..."}，reply 欄位邊生成邊送出
+    - event: field  -> {"key": "...", "value": ...}，其他欄位完整後各自送出
+    - event: done   -> 與 /api/chat 相同格式的完整結果
+    """
+    try:
+        ip = _get_client_ip()
+        allowed, wait_seconds = check_rate_limit(rule="stream")
+        if not allowed:
+            return _rate_limit_response(ip, wait_seconds)
+
+        payload, error_response = _validate_chat_payload()
+        if error_response:
+            return error_response
+
+        surcharge_response = _check_image_surcharge(ip, payload, rule="stream")
+        if surcharge_response:
+            return surcharge_response
+
+        _log_chat_request(ip, payload)
+    except Exception as e:
+        return _server_error_response(e)
+
+    timing = g.timing
+
+    def generate():
+        with metrics.request_scope(timing):
+            try:
+                events = stream_little_tone_response(
+                    payload["message"],
+                    payload["image"],
+                    history=payload["history"]
+                )
+                for event in _iterate_async_generator(events):
+                    kind = event[0]
+                    if kind == "delta":
+                        yield _sse_event("reply", {"delta": event[2]})
+                    elif kind == "field":
+                        if event[1] != "reply":
+                            yield _sse_event("field", {"key": event[1], "value": event[2]})
+                    elif kind == "done":
+                        yield _sse_event("done", {
+                            "status": "success",
+                            "data": event[1],
+                            **_record_session_turn(payload, event[1])
+                        })
+            finally:
+                metrics.finish_request(timing, 200)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 避免反向代理緩衝，確保逐段送達
+    })
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch_endpoint():
+    """
+    批次版本：一次送出多則訊息或多個語氣變體 (共用圖片、對話紀錄與 RAG 知識)，
+    只需一次 HTTP 往返；限流額度依項目數計算 (帶圖片時每則以圖片成本計)。預設以 Server-Sent Events 逐則回傳：
+    - event: item  -> {"index": 0, "id": ..., "data": 與 /api/chat 相同格式的結果}，哪一則先完成就先送出
+    - event: done  -> {"status": "success", "count": 項目數}
+    payload 帶 "stream": false 時，改為全部完成後一次回傳 {"status": "success", "data": [...]}。
+    語氣變體屬於「候選回覆」，不會寫入 Session 的對話紀錄。
+    """
+    try:
+        ip = _get_client_ip()
+        allowed, wait_seconds = check_rate_limit(rule="batch")
+        if not allowed:
+            return _rate_limit_response(ip, wait_seconds)
+
+        payload, error_response = _validate_batch_payload()
+        if error_response:
+            return error_response
+
+        cost_response = _check_batch_cost(ip, payload)
+        if cost_response:
+            return cost_response
+
+        print(f"[App] 處理批次請求 IP: {ip} | 項目: {len(payload['items'])} 則 | "
+              f"歷史: {len(payload['history'])} 則 | 圖片: {'有' if payload['image'] else '無'}")
+    except Exception as e:
+        return _server_error_response(e)
+
+    items = payload["items"]
+    session = {"session_id": payload["session_id"]} if payload["session_id"] else {}
+
+    def open_stream():
+        return stream_batch_responses(
+            [item["message"] for item in items],
+            payload["image"],
+            history=payload["history"],
+            context_query=payload["message"],
+        )
+
+    if not payload["stream"]:
+        async def collect():
+            results = [None] * len(items)
+            async for index, result in open_stream():
+                results[index] = result
+            return results
+        try:
+            results = shared_loop.run(collect())
+        except Exception as e:
+            return _server_error_response(e)
+        return jsonify({"status": "success", "data": results, **session})
+
+    timing = g.timing
+
+    def generate():
+        with metrics.request_scope(timing):
+            try:
+                for index, result in _iterate_async_generator(open_stream()):
+                    yield _sse_event("item", {"index": index, "id": items[index]["id"], "data": result})
+                yield _sse_event("done", {"status": "success", "count": len(items), **session})
+            finally:
+                metrics.finish_request(timing, 200)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/', methods=['GET'])
 def index():
@@ -124,10 +416,25 @@ def index():
 def health_check():
     return jsonify({"status": "alive", "service": "LittleTone", "version": "2.5"})
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus 格式的監控指標 (各階段延遲、快取命中、429 次數、備援回應、Prompt Token)"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 # 錯誤處理：檔案超過 5MB 時自動回傳 413
 @app.errorhandler(413)
 def request_entity_too_large(error):
     return jsonify({"status": "error", "message": "上傳內容過大，已遭系統攔截"}), 413
 
+def create_asgi_app(workers=None):
+    """
+    ASGI 入口 (uvicorn / hypercorn)：
+        uvicorn "app:create_asgi_app" --factory --workers 2
+    Flask 請求在執行緒池中處理，所有 async 工作則共用同一個事件迴圈與 OpenAI 連線池。
+    """
+    from a2wsgi import WSGIMiddleware
+    workers = workers or int(os.getenv("ASGI_THREADS", "32"))
+    return WSGIMiddleware(app, workers=workers)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
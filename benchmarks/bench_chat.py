@@ -0,0 +1,138 @@
+"""
+/api/chat 端對端壓力測試：啟動本地假 OpenAI 伺服器，依指定並行數與請求組合
+(純文字 / 截圖 / 語氣改寫) 打 app.py，輸出各類型的 p50 / p95 / p99 延遲與吞吐量 (JSON)。
+
+    python -m benchmarks.bench_chat --requests 300 --concurrency 1,8,32 \\
+        --mix text=0.6,image=0.2,tone=0.2 --latency 0.3 --output chat.json
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import environment_info, latency_summary, prepare_app_environment, write_report
+from benchmarks.fake_openai import start_fake_openai
+from services.prompts import TONE_INSTRUCTION_TEMPLATE
+
+TEXT_MESSAGES = [
+    "主管說列入參考，我該怎麼回？",
+    "朋友一直已讀不回，是不是生氣了？",
+    "同事把鍋甩給我，我要怎麼跟主管解釋比較好",
+    "長輩一直在群組傳早安圖，要回什麼才不失禮？",
+    "曖昧對象說我們先當朋友就好，這代表什麼？",
+]
+TONES = ["禮貌委婉", "直球表達", "幽默化解"]
+TONE_HISTORY = [
+    {"role": "user", "content": "主管說列入參考，我該怎麼回？"},
+    {"role": "assistant", "content": "天啊...這句話真的很難判斷耶，我們一起來想想怎麼回比較好～"},
+]
+IMAGE_MESSAGE = "幫我看看這段對話對方是什麼意思"
+DEFAULT_MIX = "text=0.6,image=0.2,tone=0.2"
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in ("text", "image", "tone"):
+            raise ValueError(f"未知的請求類型: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def build_workload(total, mix, seed=0, image_variants=8):
+    """依比例產生 (類型, payload) 清單；截圖預先產生數張並輪流使用"""
+    from benchmarks.bench_image import synthetic_screenshot_base64
+
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    images = []
+    if mix.get("image"):
+        images = [synthetic_screenshot_base64(1080, 2340, seed=i) for i in range(image_variants)]
+
+    workload = []
+    for i in range(total):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "text":
+            payload = {"message": f"{rng.choice(TEXT_MESSAGES)} #{i}"}
+        elif kind == "tone":
+            payload = {"message": TONE_INSTRUCTION_TEMPLATE.format(tone=rng.choice(TONES)), "history": TONE_HISTORY}
+        else:
+            payload = {"message": IMAGE_MESSAGE, "image": images[i % len(images)]}
+        workload.append((kind, payload))
+    return workload
+
+
+def run_load(app, workload, concurrency, path="/api/chat"):
+    client = app.test_client()
+
+    def one(item):
+        index, (kind, payload) = item
+        started = time.perf_counter()
+        response = client.post(
+            path,
+            json=payload,
+            # 每個請求使用不同 IP，避免被限流規則影響
+            environ_base={"REMOTE_ADDR": f"10.{index // 62500}.{index // 250 % 250}.{index % 250}"},
+        )
+        body = response.get_json(silent=True) or {}
+        ok = response.status_code == 200 and (body.get("data") or {}).get("analysis") != "Error"
+        return kind, time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, enumerate(workload)))
+    elapsed = time.perf_counter() - started
+
+    report = {"overall": latency_summary([r[1] for r in results], elapsed,
+                                         errors=sum(1 for r in results if not r[2]))}
+    for kind in sorted({r[0] for r in results}):
+        subset = [r for r in results if r[0] == kind]
+        report[kind] = latency_summary([r[1] for r in subset], errors=sum(1 for r in subset if not r[2]))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="每個並行數要送出的請求數")
+    parser.add_argument("--concurrency", default="1,8,32", help="並行數，以逗號分隔")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="請求組合比例，例如 text=0.6,image=0.2,tone=0.2")
+    parser.add_argument("--latency", type=float, default=0.3, help="假上游的回應延遲秒數")
+    parser.add_argument("--keep-caches", action="store_true", help="保留回應快取與截圖快取 (預設關閉)")
+    parser.add_argument("--output", help="JSON 報告輸出路徑 (預設印到 stdout)")
+    args = parser.parse_args()
+
+    server = start_fake_openai(latency=args.latency)
+    prepare_app_environment(server.base_url, keep_caches=args.keep_caches)
+
+    import app as app_module
+
+    mix = parse_mix(args.mix)
+    workload = build_workload(args.requests, mix)
+    report = {
+        "environment": environment_info(),
+        "chat_config": {
+            "requests": args.requests,
+            "mix": mix,
+            "upstream_latency_s": args.latency,
+            "keep_caches": args.keep_caches,
+        },
+        "chat": {},
+    }
+    for concurrency in [int(c) for c in args.concurrency.split(",") if c]:
+        before = server.requests
+        result = run_load(app_module.app, workload, concurrency)
+        result["upstream_requests"] = server.requests - before
+        report["chat"][f"c{concurrency}"] = result
+
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+冷啟動效能測試：每次都開新的 Python 行程，量測「匯入 app → 第一個 /health → 第一個 /api/chat」的耗時。
+
+    python -m benchmarks.bench_cold_start --repeat 5 --output cold_start.json
+
+比較三種情境 (知識庫一律從 JSON 建立)：
+- eager：模擬舊版行為 (啟動時即載入 openai / Pillow / numpy)
+- lazy：延遲匯入重量級套件，語意索引每次都在空目錄重新建立
+- lazy_prebuilt：延遲匯入 + 讀取預先建立的語意索引 (python -m services.kb_compiler)
+
+冷啟動的實際感受取決於第一個 /api/chat，因此同時報告 import_speedup 與 first_chat_speedup。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import ROOT_DIR, environment_info, write_report
+from benchmarks.fake_openai import start_fake_openai
+
+# 在子行程中執行：量測各階段耗時後以 JSON 印出最後一行
+_CHILD_SCRIPT = r"""
+import json, os, sys, time
+started = time.perf_counter()
+if os.environ.get("BENCH_EAGER_IMPORTS") == "1":
+    import openai, numpy
+    from PIL import Image
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+client.get("/health")
+health = time.perf_counter()
+response = client.post("/api/chat", json={"message": "主管說列入參考，我該怎麼回？"})
+chat = time.perf_counter()
+print(json.dumps({
+    "import_app_ms": (imported - started) * 1000,
+    "first_health_ms": (health - started) * 1000,
+    "first_chat_ms": (chat - started) * 1000,
+    "chat_status": response.status_code,
+}))
+"""
+
+SCENARIOS = {
+    "eager": {"BENCH_EAGER_IMPORTS": "1"},
+    "lazy": {},
+    "lazy_prebuilt": {"prebuilt": True},
+}
+
+
+def _run_child(env):
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", _CHILD_SCRIPT], cwd=ROOT_DIR, env=env,
+        check=True, capture_output=True, text=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def run(repeat=5):
+    server = start_fake_openai(latency=0.0, first_token_latency=0.0)
+    with tempfile.TemporaryDirectory() as tmp:
+        # 語意索引寫到暫存目錄，不影響正式的 data/index
+        prebuilt_dir = os.path.join(tmp, "prebuilt")
+        subprocess.run(
+            [sys.executable, "-m", "services.kb_compiler"], cwd=ROOT_DIR,
+            env=dict(os.environ, RAG_INDEX_DIR=prebuilt_dir), check=True, capture_output=True,
+        )
+
+        base_env = dict(os.environ)
+        base_env.update({
+            "OPENAI_BASE_URL": server.base_url,
+            "OPENAI_API_KEY": base_env.get("OPENAI_API_KEY", "sk-benchmark"),
+            "RESPONSE_CACHE_MAX_ENTRIES": "0",
+            "METRICS_TIMING_LOG": "0",
+        })
+
+        results = {}
+        for name, overrides in SCENARIOS.items():
+            overrides = dict(overrides)
+            prebuilt = overrides.pop("prebuilt", False)
+
+            def child_env(run_index):
+                # 非預建情境每次給一個新的空目錄，避免沿用上一輪寫入的索引
+                index_dir = prebuilt_dir if prebuilt else os.path.join(tmp, f"{name}-{run_index}")
+                return dict(base_env, RAG_INDEX_DIR=index_dir, **overrides)
+
+            _run_child(child_env("warmup"))  # 暖機：讓 .pyc 與作業系統檔案快取就緒，只比較行程啟動本身
+            samples = [_run_child(child_env(i)) for i in range(repeat)]
+            results[name] = {
+                key: round(statistics.median(s[key] for s in samples), 1)
+                for key in ("import_app_ms", "first_health_ms", "first_chat_ms", "process_ms")
+            }
+            results[name]["errors"] = sum(1 for s in samples if s["chat_status"] != 200)
+
+    baseline = results["eager"]
+    for name, result in results.items():
+        result["import_speedup"] = round(baseline["import_app_ms"] / result["import_app_ms"], 2)
+        result["first_chat_speedup"] = round(baseline["first_chat_ms"] / result["first_chat_ms"], 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="每種情境啟動幾次 (取中位數)")
+    parser.add_argument("--output", help="JSON 報告輸出路徑 (預設印到 stdout)")
+    args = parser.parse_args()
+
+    write_report({"environment": environment_info(), "cold_start": run(args.repeat)}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+比較「每個請求新開事件迴圈 (flask[async] 預設)」與「共用事件迴圈 + 連線池」的差異。
+
+    python -m benchmarks.bench_event_loop --requests 200 --concurrency 32 --latency 0.2
+
+兩種模式都打本地假 OpenAI 伺服器，輸出吞吐量、延遲與上游 TCP 連線數 (JSON)。
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import latency_summary, prepare_app_environment, write_report
+from benchmarks.fake_openai import start_fake_openai
+
+
+def _run(app, total, concurrency):
+    client = app.test_client()
+
+    def one(i):
+        started = time.perf_counter()
+        response = client.post(
+            "/api/chat",
+            json={"message": f"主管說列入參考，我該怎麼回？ #{i}"},
+            environ_base={"REMOTE_ADDR": f"10.0.{i // 250}.{i % 250}"},
+        )
+        body = response.get_json() or {}
+        ok = response.status_code == 200 and (body.get("data") or {}).get("analysis") != "Error"
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+
+    return latency_summary([r[0] for r in results], elapsed, errors=sum(1 for r in results if not r[1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    server = start_fake_openai(latency=args.latency)
+    prepare_app_environment(server.base_url)
+
+    import app as app_module
+    from flask import Flask
+    app = app_module.app
+
+    report = {}
+    # 先跑共用事件迴圈模式，避免被另一模式留下的失效連線干擾
+    # 模式一：共用事件迴圈 + 明確設定的連線池
+    before = server.connections
+    report["shared_loop"] = _run(app, args.requests, args.concurrency)
+    report["shared_loop"]["upstream_connections"] = server.connections - before
+
+    # 模式二：flask[async] 預設行為，每個請求都建立新的事件迴圈 (連線池無法跨迴圈重用)
+    app.async_to_sync = lambda func: Flask.async_to_sync(app, func)
+    before = server.connections
+    report["per_request_loop"] = _run(app, args.requests, args.concurrency)
+    report["per_request_loop"]["upstream_connections"] = server.connections - before
+
+    write_report(report)
+
+
+if __name__ == "__main__":
+    main()
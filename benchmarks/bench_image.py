@@ -0,0 +1,105 @@
+"""
+截圖壓縮效能測試：以常見手機 / 桌面解析度產生模擬聊天截圖，
+量測 ImageService.process_and_compress_base64 的延遲與壓縮率。
+
+    python -m benchmarks.bench_image --repeat 20 --output image.json
+"""
+import argparse
+import base64
+import io
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import environment_info, latency_summary, timed, write_report
+
+# (名稱, 寬, 高)：常見的手機截圖與桌面視窗解析度
+SCREENSHOT_SIZES = [
+    ("iphone_se", 750, 1334),
+    ("android_fhd", 1080, 2340),
+    ("iphone_pro_max", 1290, 2796),
+    ("desktop_fhd", 1920, 1080),
+]
+FORMATS = ("PNG", "JPEG")
+
+
+def synthetic_screenshot(width, height, seed=0, fmt="PNG"):
+    """
+    產生類似聊天 App 的截圖 (淺色底、左右交錯的對話泡泡與文字列)，回傳編碼後的位元組。
+    內容由 seed 決定，相同參數一定得到相同的圖片。
+    """
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), (236, 229, 221))
+    draw = ImageDraw.Draw(img)
+    # 上方標題列
+    draw.rectangle([0, 0, width, height // 14], fill=(7, 94, 84))
+    y = height // 12
+    line_height = max(12, width // 36)
+    while y < height - line_height * 3:
+        lines = rng.randint(1, 4)
+        bubble_w = int(width * rng.uniform(0.35, 0.75))
+        bubble_h = lines * line_height + line_height
+        mine = rng.random() < 0.5
+        x0 = width - bubble_w - width // 30 if mine else width // 30
+        color = (220, 248, 198) if mine else (255, 255, 255)
+        draw.rounded_rectangle([x0, y, x0 + bubble_w, y + bubble_h], radius=line_height // 2, fill=color)
+        for i in range(lines):
+            text = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(bubble_w // (line_height // 2)))
+            draw.text((x0 + line_height // 2, y + line_height // 2 + i * line_height), text, fill=(30, 30, 30))
+        y += bubble_h + line_height
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, quality=92)
+    return buffer.getvalue()
+
+
+def synthetic_screenshot_base64(width, height, seed=0, fmt="PNG"):
+    return base64.b64encode(synthetic_screenshot(width, height, seed, fmt)).decode("utf-8")
+
+
+def run(repeat=10):
+    # 匯入 services 套件時會建立 OpenAI client，離線測試只需要一個假的 Key
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    from services.image_service import ImageService
+
+    results = {}
+    for name, width, height in SCREENSHOT_SIZES:
+        for fmt in FORMATS:
+            # 每次使用不同內容，避免任何層級的快取影響結果
+            samples = [synthetic_screenshot_base64(width, height, seed, fmt) for seed in range(repeat)]
+            latencies, output_bytes = [], []
+            errors = 0
+            ImageService.process_and_compress_base64(samples[0])  # 暖機 (載入解碼器)
+            for sample in samples:
+                compressed, elapsed = timed(ImageService.process_and_compress_base64, sample)
+                if not compressed:
+                    errors += 1
+                    continue
+                latencies.append(elapsed)
+                output_bytes.append(len(compressed) * 3 // 4)
+            input_bytes = sum(len(s) * 3 // 4 for s in samples) // len(samples)
+            summary = latency_summary(latencies, errors=errors)
+            summary.update({
+                "size": f"{width}x{height}",
+                "format": fmt,
+                "input_bytes": input_bytes,
+                "output_bytes": sum(output_bytes) // len(output_bytes) if output_bytes else 0,
+            })
+            results[f"{name}_{fmt.lower()}"] = summary
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="每種解析度 / 格式的測試次數")
+    parser.add_argument("--output", help="JSON 報告輸出路徑 (預設印到 stdout)")
+    args = parser.parse_args()
+
+    write_report({"environment": environment_info(), "image": run(args.repeat)}, args.output)
+
+
+if __name__ == "__main__":
+    main()
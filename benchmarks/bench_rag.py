@@ -0,0 +1,123 @@
+"""
+RAG 檢索效能測試：以 data/*.json 為基礎合成 1× / 10× / 100× 大小的知識庫，
+量測索引建立時間與 retrieve_social_knowledge 的查詢延遲。
+
+    python -m benchmarks.bench_rag --scales 1,10,100 --queries 200 --output rag.json
+"""
+import argparse
+import copy
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import environment_info, latency_summary, timed, write_report
+
+# 合成詞彙時接在原詞後面的常用字，讓複本是「不同但相似」的關鍵字
+_SUFFIX_CHARS = "的了是在有人我他這個們來到時大地為子中你說生國年著就那和要她出也得裡後自以會"
+
+MISS_QUERIES = [
+    "今天天氣不錯",
+    "幫我算一下 37 乘以 42",
+    "Hello, how are you?",
+]
+
+
+def _variant(text, rng):
+    return text + "".join(rng.choice(_SUFFIX_CHARS) for _ in range(rng.randint(1, 2)))
+
+
+def synthesize(terms, scenarios, scale, seed=0):
+    """
+    複製 scale 倍的知識庫：第一份為原始資料，其餘複本的詞彙與關鍵字都加上隨機後綴，
+    使關鍵字數量與比對自動機的大小隨倍數成長。
+    """
+    rng = random.Random(seed)
+    out_terms, out_scenarios = list(terms), list(scenarios)
+    for _ in range(scale - 1):
+        for item in terms:
+            clone = dict(item)
+            clone["term"] = _variant(item["term"], rng)
+            out_terms.append(clone)
+        for scene in scenarios:
+            clone = copy.deepcopy(scene)
+            analysis = clone.setdefault("contextual_analysis", {})
+            analysis["keywords"] = [_variant(kw, rng) for kw in analysis.get("keywords", [])]
+            out_scenarios.append(clone)
+    return out_terms, out_scenarios
+
+
+def sample_queries(terms, scenarios, count, seed=0):
+    """真實感的查詢：場景原句、詞彙例句，再混入少量完全不相關的句子"""
+    rng = random.Random(seed)
+    pool = [scene.get("input_text", "") for scene in scenarios if scene.get("input_text")]
+    pool += [item.get("local_context", "") for item in terms if item.get("local_context")]
+    queries = [rng.choice(pool) for _ in range(count)]
+    for i in range(0, count, 10):
+        queries[i] = MISS_QUERIES[i // 10 % len(MISS_QUERIES)]
+    return queries
+
+
+def run(scales=(1, 10, 100), query_count=200, modes=("hybrid", "exact")):
+    # 匯入 services 套件時會建立 OpenAI client，離線測試只需要一個假的 Key
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    from services import rag_service
+
+    terms = rag_service.load_json_data(rag_service.DICT_PATH)
+    scenarios = rag_service.load_json_data(rag_service.SCENARIO_PATH)
+    queries = sample_queries(terms, scenarios, query_count)
+
+    original_kb, original_index_dir = rag_service._knowledge_base, rag_service.RAG_INDEX_DIR
+    results = {}
+    try:
+        for scale in scales:
+            scaled_terms, scaled_scenarios = synthesize(terms, scenarios, scale)
+            with tempfile.TemporaryDirectory() as index_dir:
+                # 向量索引寫到暫存目錄，不覆蓋正式的 data/index
+                rag_service.RAG_INDEX_DIR = index_dir
+                kb, build_seconds = timed(rag_service.SocialKnowledgeBase, scaled_terms, scaled_scenarios)
+                _, semantic_seconds = timed(kb.semantic_index)
+                rag_service._knowledge_base = kb
+
+                entry = {
+                    "terms": len(kb.terms),
+                    "scenarios": len(kb.scenarios),
+                    "keywords": len(kb.matcher),
+                    "build_ms": round(build_seconds * 1000, 1),
+                    "semantic_index_build_ms": round(semantic_seconds * 1000, 1),
+                }
+                for mode in modes:
+                    rag_service.retrieve_social_knowledge(queries[0], mode=mode)  # 暖機
+                    latencies, hits = [], 0
+                    started = time.perf_counter()
+                    for query in queries:
+                        context, elapsed = timed(rag_service.retrieve_social_knowledge, query, mode=mode)
+                        latencies.append(elapsed)
+                        hits += bool(context)
+                    summary = latency_summary(latencies, time.perf_counter() - started)
+                    summary["hit_rate"] = round(hits / len(queries), 4)
+                    entry[mode] = summary
+                results[f"{scale}x"] = entry
+    finally:
+        rag_service._knowledge_base, rag_service.RAG_INDEX_DIR = original_kb, original_index_dir
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="1,10,100", help="知識庫放大倍數，以逗號分隔")
+    parser.add_argument("--queries", type=int, default=200, help="每種規模的查詢次數")
+    parser.add_argument("--modes", default="hybrid,exact", help="檢索模式，以逗號分隔")
+    parser.add_argument("--output", help="JSON 報告輸出路徑 (預設印到 stdout)")
+    args = parser.parse_args()
+
+    scales = [int(s) for s in args.scales.split(",") if s]
+    modes = [m for m in args.modes.split(",") if m]
+    write_report({"environment": environment_info(), "rag": run(scales, args.queries, modes)}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""效能測試共用工具：延遲統計、執行環境資訊與 JSON 報告輸出。"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values, q):
+    """最近秩 (nearest-rank) 百分位數；sorted_values 必須已排序"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(q / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(latencies, elapsed=None, errors=0):
+    """把一組延遲 (秒) 整理成 p50 / p95 / p99 (毫秒)，有總耗時時一併計算吞吐量"""
+    values = sorted(latencies)
+    summary = {
+        "count": len(values),
+        "errors": errors,
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+    if elapsed:
+        summary["throughput_rps"] = round(len(values) / elapsed, 2)
+    return summary
+
+
+def timed(func, *args, **kwargs):
+    """執行一次並回傳 (結果, 耗時秒數)"""
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def environment_info():
+    """報告附上的執行環境，方便比對不同機器 / 版本的結果"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def prepare_app_environment(base_url, keep_caches=False):
+    """
+    必須在匯入 app 之前呼叫：上游改打假伺服器並放寬限流；
+    預設關閉回應快取與截圖快取，量到的才是完整處理流程。
+    """
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ["RATE_LIMIT_CHAT_CAPACITY"] = "1000000000"
+    if not keep_caches:
+        os.environ["RESPONSE_CACHE_MAX_ENTRIES"] = "0"
+        os.environ["IMAGE_CACHE_MAX_ENTRIES"] = "0"
+
+
+def write_report(report, output=None):
+    """輸出 JSON 報告：指定路徑時寫檔，否則印到 stdout"""
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"[Benchmark] 報告已寫入 {output}", file=sys.stderr)
+    else:
+        print(text)
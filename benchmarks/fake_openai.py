@@ -0,0 +1,173 @@
+"""
+本地假 OpenAI Chat Completions 伺服器 (僅供效能測試使用)。
+
+    python -m benchmarks.fake_openai --port 8799 --latency 0.8
+
+啟動後將 OPENAI_BASE_URL 設為 http://127.0.0.1:8799/v1 即可讓 LittleTone 改打這台伺服器。
+支援 stream=True (SSE 逐段輸出)、可調整延遲與首字延遲，並統計 TCP 連線數以觀察連線重用情形。
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PAYLOAD = {
+    "status": "ready",
+    "need_more_info": False,
+    "reply": "天啊...遇到這種狀況真的會讓人很心累耶，辛苦你了啦。我們一起來想想怎麼回比較好～",
+    "suggested_scenarios": [
+        {"title": "[禮貌委婉]", "example": "不好意思，想說跟你確認一下這件事，再麻煩你了🙏"},
+        {"title": "[直球表達]", "example": "我有點在意這件事，想跟你好好聊聊。"},
+        {"title": "[折衷提議]", "example": "要不要我們找個時間一起討論，看怎麼做比較好？"},
+    ],
+    "key_change": "💡 核心洞察：先接住情緒，再提出具體請求。",
+    "analysis": "對方可能只是忙碌，並非刻意冷淡。",
+    "tip": "用「想說」、「稍微」讓語氣更柔軟。",
+}
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256
+
+    def __init__(self, address, latency=0.5, first_token_latency=0.2, chunk_size=8,
+                 chunk_interval=0.01, payload=None):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.first_token_latency = first_token_latency
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_interval
+        self.payload = payload or DEFAULT_PAYLOAD
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def start_background(self):
+        thread = threading.Thread(target=self.serve_forever, name="fake-openai", daemon=True)
+        thread.start()
+        return thread
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支援 keep-alive，才能觀察用戶端是否重用連線
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.server.count("requests")
+        content = json.dumps(self.server.payload, ensure_ascii=False)
+        if body.get("stream"):
+            self._stream(body, content)
+        else:
+            time.sleep(self.server.latency)
+            self._send_json(200, _completion(body, content))
+
+    def _send_json(self, status, data):
+        raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _stream(self, body, content):
+        server = self.server
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        time.sleep(server.first_token_latency)
+        pieces = [content[i:i + server.chunk_size] for i in range(0, len(content), server.chunk_size)]
+        for piece in pieces:
+            self._write_chunk(_stream_chunk(body, piece))
+            time.sleep(server.chunk_interval)
+        self._write_chunk(_stream_chunk(body, None, finish_reason="stop"))
+        self._write_raw(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data):
+        self._write_raw(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def _write_raw(self, raw):
+        self.wfile.write(f"{len(raw):x}\r\n".encode("ascii") + raw + b"\r\n")
+        self.wfile.flush()
+
+
+def _completion(body, content):
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def _stream_chunk(body, piece, finish_reason=None):
+    delta = {} if piece is None else {"content": piece}
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def start_fake_openai(port=0, **options):
+    """在背景執行緒啟動假伺服器並回傳 server 物件 (port=0 代表自動挑選可用埠)"""
+    server = FakeOpenAIServer(("127.0.0.1", port), **options)
+    server.start_background()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LittleTone 本地假 OpenAI 伺服器")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--latency", type=float, default=0.5, help="非串流回應的延遲秒數")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="串流首個片段的延遲秒數")
+    parser.add_argument("--chunk-size", type=int, default=8)
+    parser.add_argument("--chunk-interval", type=float, default=0.01)
+    parser.add_argument("--payload", help="自訂回傳內容的 JSON 檔案路徑")
+    args = parser.parse_args()
+
+    payload = None
+    if args.payload:
+        with open(args.payload, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+
+    server = FakeOpenAIServer(
+        ("127.0.0.1", args.port),
+        latency=args.latency,
+        first_token_latency=args.first_token_latency,
+        chunk_size=args.chunk_size,
+        chunk_interval=args.chunk_interval,
+        payload=payload,
+    )
+    print(f"[FakeOpenAI] 監聽 {server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,65 @@
+"""
+一次執行所有離線效能測試，合併成單一 JSON 報告 (方便存檔並與前一版比較)。
+
+    python -m benchmarks.run_all --output benchmark.json
+    python -m benchmarks.run_all --quick          # 縮小規模，適合 CI 快速檢查
+
+每項測試都在獨立的子行程執行，避免環境變數與全域單例互相影響。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import ROOT_DIR, environment_info, write_report
+
+SUITES = {
+    "chat": ["benchmarks.bench_chat", "--requests", "200", "--concurrency", "1,8,32"],
+    "rag": ["benchmarks.bench_rag", "--scales", "1,10,100", "--queries", "200"],
+    "image": ["benchmarks.bench_image", "--repeat", "10"],
+    "cold_start": ["benchmarks.bench_cold_start", "--repeat", "5"],
+}
+QUICK_SUITES = {
+    "chat": ["benchmarks.bench_chat", "--requests", "40", "--concurrency", "1,8", "--latency", "0.05"],
+    "rag": ["benchmarks.bench_rag", "--scales", "1,10", "--queries", "50"],
+    "image": ["benchmarks.bench_image", "--repeat", "3"],
+    "cold_start": ["benchmarks.bench_cold_start", "--repeat", "2"],
+}
+
+
+def run_suite(module_args):
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "report.json")
+        subprocess.run(
+            [sys.executable, "-m", *module_args, "--output", output],
+            cwd=ROOT_DIR, check=True, stdout=subprocess.DEVNULL,
+        )
+        with open(output, "r", encoding="utf-8") as f:
+            report = json.load(f)
+    report.pop("environment", None)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help="只執行指定的測試，以逗號分隔 (chat,rag,image,cold_start)")
+    parser.add_argument("--quick", action="store_true", help="縮小規模快速執行")
+    parser.add_argument("--output", help="JSON 報告輸出路徑 (預設印到 stdout)")
+    args = parser.parse_args()
+
+    suites = QUICK_SUITES if args.quick else SUITES
+    selected = args.only.split(",") if args.only else list(suites)
+
+    report = {"environment": environment_info(), "quick": args.quick}
+    for name in selected:
+        print(f"[Benchmark] 執行 {name} ...", file=sys.stderr)
+        report.update(run_suite(suites[name]))
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,41 @@
 # services/__init__.py
+import importlib
 
-# 1. 從各個子模組導入核心函式或類別
-from .chat_service import ChatService, get_little_tone_final_response
-from .image_service import ImageService
-
-# 2. 正式啟用 RAG 服務，將註解移除
-from .rag_service import retrieve_social_knowledge
+# 1. 對外公開的名稱與所在的子模組
+#    採延遲匯入：第一次取用時才載入對應模組，冷啟動不必一次載入 openai / Pillow / numpy
+_EXPORTS = {
+    "ChatService": ".chat_service",
+    "get_little_tone_final_response": ".chat_service",
+    "stream_little_tone_response": ".chat_service",
+    "stream_batch_responses": ".chat_service",
+    "ImageService": ".image_service",
+    # 2. 正式啟用 RAG 服務
+    "retrieve_social_knowledge": ".rag_service",
+    "select_social_knowledge": ".rag_service",
+    "get_knowledge_base": ".rag_service",
+}
 
 # 3. 定義對外公開的接口清單
 __all__ = [
     "ChatService",
     "get_little_tone_final_response",
+    "stream_little_tone_response",
+    "stream_batch_responses",
     "ImageService",
-    "retrieve_social_knowledge"  # 確保這行有加入
-]
\ No newline at end of file
+    "retrieve_social_knowledge",  # 確保這行有加入
+    "select_social_knowledge",
+    "get_knowledge_base"
+]
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,81 +1,590 @@
 import os
 import json
 import re
-from openai import AsyncOpenAI
-from .prompts import get_formatted_prompt
-from .rag_service import retrieve_social_knowledge
+import asyncio
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from .prompts import build_prompt_messages, PROMPT_VERSION
+from .rag_service import select_social_knowledge, assemble_context, knowledge_version, get_knowledge_base
 from .image_service import ImageService
+from .response_cache import response_cache, request_fingerprint, digest_bytes
+from .stream_parser import StreamingJSONParser
+from .single_flight import single_flight
+from .history_manager import history_manager
+from .request_router import route_request, is_tone_instruction
+from .hedging import latency_tracker, hedged
+from .fallback_service import build_local_response
+from . import metrics
+from .tokens import estimate_tokens
 
-# 初始化 OpenAI 客戶端
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# --- 上游連線設定 ---
+# 明確設定連線池：搭配共用事件迴圈 (services/event_loop.py)，每個 worker 只維持一組長連線
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "64"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "32"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# 每個 worker 同時進行中的上游呼叫上限，超過的請求在本地排隊，避免壓垮 API 配額
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "32"))
+# 文字類請求 (診斷 / 語氣改寫 / 快捷回覆) 最多可佔用的名額，其餘保留給較昂貴的截圖分析
+UPSTREAM_TEXT_MAX_CONCURRENCY = int(os.getenv(
+    "UPSTREAM_TEXT_MAX_CONCURRENCY", str(max(1, UPSTREAM_MAX_CONCURRENCY - 8))
+))
+
+# --- 批次請求設定 ---
+# 單一批次最多幾則訊息 / 語氣變體，以及同一批次內同時呼叫上游的數量
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "3"))
+# 語氣名稱會直接套進指令範本，限制長度避免被拿來夾帶任意提示詞
+BATCH_TONE_MAX_CHARS = int(os.getenv("BATCH_TONE_MAX_CHARS", "20"))
+
+# OpenAI 客戶端 (首次呼叫上游時才建立，見 get_client)
+client = None
+_client_lock = threading.Lock()
+# 依事件迴圈分開的 Semaphore 組 (正常情況下只有共用事件迴圈這一個)
+_upstream_slots = weakref.WeakKeyDictionary()
+_prompt_version = None
+
+def get_client():
+    """
+    取得 (必要時建立) 全域共用的 OpenAI 客戶端。
+    openai SDK 匯入成本將近一秒，延後到第一次呼叫上游時才載入，Serverless 冷啟動不必等待。
+    """
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                import httpx
+                from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+                client = AsyncOpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    base_url=os.getenv("OPENAI_BASE_URL") or None,
+                    max_retries=OPENAI_MAX_RETRIES,
+                    timeout=OPENAI_TIMEOUT,
+                    http_client=DefaultAsyncHttpxClient(
+                        limits=httpx.Limits(
+                            max_connections=OPENAI_MAX_CONNECTIONS,
+                            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                            keepalive_expiry=60,
+                        ),
+                    ),
+                )
+    return client
+
+async def get_client_async():
+    """
+    在事件迴圈中取得客戶端：尚未建立時改到執行緒池匯入 openai 並建立，
+    避免近一秒的同步匯入卡住共用事件迴圈上的其他請求、串流與期限計時。
+    """
+    if client is not None:
+        return client
+    return await asyncio.get_running_loop().run_in_executor(None, get_client)
+
+def warm_up():
+    """
+    在背景執行緒預先建立客戶端並載入語意索引 (app 啟動時呼叫)：
+    openai / numpy 的匯入不拖慢啟動，第一個請求也不必在事件迴圈上等待
+    """
+    def run():
+        try:
+            get_client()
+        except Exception as e:
+            print(f"[ChatService] 預先建立 OpenAI 客戶端失敗 (將於第一次呼叫時重試): {e}")
+        try:
+            get_knowledge_base().semantic_index()
+        except Exception as e:
+            print(f"[ChatService] 預先載入語意索引失敗: {e}")
+
+    thread = threading.Thread(target=run, name="littletone-warmup", daemon=True)
+    thread.start()
+    return thread
+
+@asynccontextmanager
+async def upstream_slot(pool="vision"):
+    """
+    取得一個上游呼叫名額 (全域並行上限)。
+    pool="text" 的請求還要先取得文字類名額，尖峰時也不會把截圖分析的名額用光。
+    """
+    loop = asyncio.get_running_loop()
+    semaphores = _upstream_slots.get(loop)
+    if semaphores is None:
+        semaphores = _upstream_slots[loop] = {
+            "all": asyncio.Semaphore(UPSTREAM_MAX_CONCURRENCY),
+            "text": asyncio.Semaphore(UPSTREAM_TEXT_MAX_CONCURRENCY),
+        }
+    if pool == "text":
+        async with semaphores["text"], semaphores["all"]:
+            yield
+    else:
+        async with semaphores["all"]:
+            yield
+
+def upstream_has_capacity(pool="vision"):
+    """目前是否還有空的上游名額 (對沖請求只在有餘裕時送出，不與排隊中的請求搶名額)"""
+    semaphores = _upstream_slots.get(asyncio.get_running_loop())
+    if semaphores is None:
+        return True
+    if pool == "text" and semaphores["text"].locked():
+        return False
+    return not semaphores["all"].locked()
 
 class ChatService:
     @staticmethod
     async def get_little_tone_final_response(user_text, image_base64=None, history=None):
         """
         核心邏輯：整合 RAG 檢索、歷史紀錄、圖片壓縮與 OpenAI 生成。
+        超過請求類別的延遲預算時，改回傳只用知識庫組出的在地備援回覆。
         """
+        started = time.perf_counter()
         try:
-            # 1. 執行 RAG 檢索 (維持你的內部自動呼叫邏輯)
-            context_info = retrieve_social_knowledge(user_text)
-            
-            # 2. 產生成含有在地化知識的 System Prompt
-            system_prompt = get_formatted_prompt(context_info)
-            messages = [{"role": "system", "content": system_prompt}]
-            
-            # 3. 注入對話紀錄 (採納組員的 History 管理，維持連貫性)
-            if history and isinstance(history, list):
-                # 取最近 6 則訊息以維持上下文記憶
-                messages.extend(history[-6:])
-            
-            # 4. 構建當前的使用者輸入內容
-            user_content = []
-            if user_text:
-                user_content.append({"type": "text", "text": user_text})
-            elif image_base64:
-                # 若僅有圖片，給予預設指令
-                user_content.append({"type": "text", "text": "請幫我分析這張截圖的社交脈絡。"})
-                
-            # 5. 處理圖片壓縮 (維持你的效能優化邏輯)
-            if image_base64:
-                # 呼叫 ImageService 進行二次壓縮，節省成本
-                compressed_image = ImageService.process_and_compress_base64(image_base64)
-                user_content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{compressed_image}",
-                        "detail": "high" # 確保 AI 能看清截圖文字
-                    }
-                })
-
-            messages.append({"role": "user", "content": user_content})
-
-            # 6. 呼叫 OpenAI
-            response = await client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                response_format={"type": "json_object"}, # 確保輸出格式
-                temperature=0.4 # 取中間值，兼顧穩定與創意
+            # 0. 圖片先計算感知雜湊並壓縮 (重複的截圖會直接命中截圖快取)
+            processed_image = await ChatService._prepare_image(image_base64)
+            route = ChatService._select_route(user_text, processed_image, history)
+
+            # 1~2. 截取對話紀錄並查詢回應快取
+            recent_history, cache_key, cached = ChatService._lookup_cache(
+                user_text, processed_image, history, route
             )
+            if cached is not None:
+                return cached
 
-            # 7. 使用組員的 JSON 清理機制解析結果
-            return ChatService._parse_json_content(response.choices[0].message.content)
+            # 3~9. 同時進行中的相同請求只呼叫一次上游，其餘共用結果
+            #      超過期限時只有這個呼叫端先離開，上游結果晚點仍會寫入快取
+            try:
+                return await asyncio.wait_for(
+                    single_flight.run(
+                        cache_key,
+                        lambda: ChatService._generate(user_text, processed_image, recent_history, cache_key, route)
+                    ),
+                    ChatService._remaining(started, route),
+                )
+            except asyncio.TimeoutError:
+                return ChatService._deadline_fallback(user_text, history, route)
 
         except Exception as e:
             print(f"[ChatService Error]: {str(e)}")
+            metrics.fallback_responses_total.inc(reason=type(e).__name__)
             return ChatService._get_error_response()
 
+    @staticmethod
+    async def _generate(user_text, processed_image, recent_history, cache_key, route, context_info=None):
+        """實際呼叫上游並寫入快取 (由 single_flight 保證同一個 cache_key 同時只執行一次)"""
+        # 3~6. RAG 檢索、組裝 Prompt 與使用者輸入
+        messages = ChatService._build_messages(user_text, processed_image, recent_history, route, context_info)
+
+        # 7. 依請求類別的模型與輸出上限呼叫 OpenAI (受並行上限控管，必要時送出對沖請求)
+        response = await ChatService._complete(route, messages)
+
+        # 輸出達到 max_tokens 上限時 JSON 不完整，改用在地備援回覆 (不寫入快取)
+        choice = response.choices[0]
+        if getattr(choice, "finish_reason", None) == "length":
+            return ChatService._length_fallback(user_text, recent_history, route)
+
+        # 8. 使用組員的 JSON 清理機制解析結果
+        result = ChatService._parse_json_content(choice.message.content)
+
+        # 9. 只快取成功解析的結果，錯誤回應不寫入
+        if not ChatService._is_error_response(result):
+            response_cache.set(cache_key, result)
+        return result
+
+    @staticmethod
+    async def stream_little_tone_response(user_text, image_base64=None, history=None):
+        """
+        串流版本：邊接收 GPT 輸出邊解析 JSON。
+        依序產生 ("delta", "reply", 文字片段)、("field", 欄位, 值)，最後一定以 ("done", 完整結果) 結束。
+        超過延遲預算時停止接收，以在地備援回覆作為 ("done", ...) 的結果；
+        若已送出部分內容，done 保留已送出的欄位 (reply 與畫面上一致)，只以備援回覆補齊其餘欄位。
+        """
+        started = time.perf_counter()
+        try:
+            processed_image = await ChatService._prepare_image(image_base64)
+            route = ChatService._select_route(user_text, processed_image, history)
+            recent_history, cache_key, cached = ChatService._lookup_cache(
+                user_text, processed_image, history, route
+            )
+            if cached is not None:
+                # 命中快取時直接把完整結果拆成同樣的事件順序送出
+                if cached.get("reply"):
+                    yield ("delta", "reply", cached["reply"])
+                for key, value in cached.items():
+                    yield ("field", key, value)
+                yield ("done", cached)
+                return
+
+            messages = ChatService._build_messages(user_text, processed_image, recent_history, route)
+            parser = StreamingJSONParser(stream_keys=("reply",))
+            # 上游串流在獨立的 Task 中接收，這裡每次等待都受期限限制 (含排隊等名額的時間)
+            chunks = asyncio.Queue()
+            producer = asyncio.ensure_future(ChatService._stream_upstream(route, messages, chunks))
+            sent = {}  # 已送給前端的欄位 (reply 為目前累積的文字)
+            try:
+                while True:
+                    text = await asyncio.wait_for(chunks.get(), ChatService._remaining(started, route))
+                    if text is None:
+                        break
+                    for kind, key, value in parser.feed(text):
+                        sent[key] = sent.get(key, "") + value if kind == "delta" else value
+                        yield (kind, key, value)
+                finish_reason = await producer  # 取出上游的例外 (若有)
+            except asyncio.TimeoutError:
+                fallback = ChatService._deadline_fallback(user_text, history, route)
+                if sent:
+                    metrics.annotate(fallback="deadline_partial")
+                yield ("done", {**fallback, **sent})
+                return
+            finally:
+                producer.cancel()
+
+            if finish_reason == "length":
+                # 與超過期限相同：保留已送出的欄位，其餘以備援回覆補齊
+                fallback = ChatService._length_fallback(user_text, history, route)
+                yield ("done", {**fallback, **sent})
+                return
+
+            result = ChatService._parse_json_content(parser.buffer)
+            if not ChatService._is_error_response(result):
+                response_cache.set(cache_key, result)
+            yield ("done", result)
+
+        except Exception as e:
+            print(f"[ChatService Stream Error]: {str(e)}")
+            metrics.fallback_responses_total.inc(reason=type(e).__name__)
+            yield ("done", ChatService._get_error_response())
+
+    @staticmethod
+    async def stream_batch_responses(items, image_base64=None, history=None, context_query=None):
+        """
+        批次版本：多則訊息 / 語氣變體共用同一份圖片、對話紀錄與 RAG 知識，
+        Prompt 只有最後一則使用者訊息不同 (前綴完全相同，可命中上游 Prompt Caching)。
+        以有上限的並行同時呼叫上游，哪一則先完成就先產生 (index, 結果)。
+        """
+        try:
+            processed_image = await ChatService._prepare_image(image_base64)
+            recent_history = ChatService._compact_history(history)
+            # 共用的 RAG 查詢：優先使用呼叫端提供的脈絡，其次是批次中的一般訊息，
+            # 全部都是語氣指令時改用對話紀錄中最後一則使用者訊息
+            if not context_query:
+                context_query = "\n".join(text for text in items if not is_tone_instruction(text))
+            if not context_query:
+                context_query = next(
+                    (m["content"] for m in reversed(recent_history) if m.get("role") == "user"), ""
+                )
+            context_info = ChatService._retrieve_context(context_query)
+        except Exception as e:
+            print(f"[ChatService Batch Error]: {str(e)}")
+            metrics.fallback_responses_total.inc(reason=type(e).__name__)
+            for index in range(len(items)):
+                yield index, ChatService._get_error_response()
+            return
+
+        # 共用脈絡的摘要併入快取 Key：同一則訊息在不同的批次脈絡下不會誤用彼此的結果
+        prompt_version = f"{ChatService._prompt_version()}:{digest_bytes(context_info)[:16]}"
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def run_item(index, user_text):
+            async with semaphore:
+                # 期限從取得並行名額後才開始計算，排隊等待的時間不算在單則的延遲預算內
+                item_started = time.perf_counter()
+                try:
+                    # 每一則各自分類：語氣變體走輕量路由，一般訊息走完整診斷
+                    route = ChatService._select_route(user_text, processed_image, history, annotate=False)
+                    cache_key = ChatService._cache_key(
+                        prompt_version, recent_history, user_text, processed_image, route
+                    )
+                    cached = ChatService._cached_response(cache_key)
+                    if cached is not None:
+                        return index, cached
+                    return index, await asyncio.wait_for(
+                        single_flight.run(
+                            cache_key,
+                            lambda: ChatService._generate(
+                                user_text, processed_image, recent_history, cache_key, route, context_info
+                            )
+                        ),
+                        ChatService._remaining(item_started, route),
+                    )
+                except asyncio.TimeoutError:
+                    return index, ChatService._deadline_fallback(user_text, history, route)
+                except Exception as e:
+                    print(f"[ChatService Batch Error] #{index}: {str(e)}")
+                    metrics.fallback_responses_total.inc(reason=type(e).__name__)
+                    return index, ChatService._get_error_response()
+
+        tasks = [asyncio.ensure_future(run_item(i, text)) for i, text in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 呼叫端中途離開 (例如連線中斷) 時取消尚未完成的項目
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    async def _prepare_image(image_base64):
+        """壓縮截圖並取得感知雜湊 (於執行緒池執行，不阻塞事件迴圈)；沒有圖片時回傳 None"""
+        if not image_base64:
+            return None
+        with metrics.stage("image"):
+            processed_image = await ImageService.process_screenshot_async(image_base64)
+        if not processed_image:
+            raise ValueError("圖片處理失敗，無法送出分析")
+        # 壓縮在執行緒池執行，拿不到請求的計時紀錄，回到事件迴圈後再補記
+        metrics.annotate(image_cache="hit" if processed_image["cache_hit"] else "miss")
+        return processed_image
+
+    @staticmethod
+    def _select_route(user_text, processed_image, history, annotate=True):
+        """判斷請求類別並記錄路由決策 (批次請求的各項目不寫入單一請求的紀錄)"""
+        route = route_request(user_text, processed_image is not None, history)
+        metrics.route_decisions_total.inc(route=route["name"], model=route["model"])
+        if annotate:
+            metrics.annotate(route=route["name"], model=route["model"])
+        return route
+
+    @staticmethod
+    def _lookup_cache(user_text, processed_image, history, route):
+        """壓縮對話紀錄並查詢回應快取，回傳 (recent_history, cache_key, 快取結果或 None)"""
+        # 1. 依 Token 預算壓縮對話紀錄：保留最新的原文，較早的收斂成摘要
+        recent_history = ChatService._compact_history(history)
+
+        # 2. 查詢回應快取 (命中時 RAG 與 Prompt 組裝都可省略)
+        #    圖片以感知雜湊作為 Key，重新存檔過的同一張截圖也能命中
+        cache_key = ChatService._cache_key(
+            ChatService._prompt_version(), recent_history, user_text, processed_image, route
+        )
+        return recent_history, cache_key, ChatService._cached_response(cache_key)
+
+    @staticmethod
+    def _cache_key(prompt_version, recent_history, user_text, processed_image, route):
+        # Prompt 變體與模型都會影響輸出，一併納入快取 Key
+        return request_fingerprint(
+            f"{prompt_version}:{route['prompt']}",
+            recent_history,
+            user_text,
+            processed_image["digest"] if processed_image else "",
+            route["model"],
+            route["temperature"],
+        )
+
+    @staticmethod
+    def _compact_history(history):
+        recent_history, history_stats = history_manager.compact(history)
+        if history_stats["summarized"] or history_stats["shrunk"] or history_stats["dropped"]:
+            print(f"[ChatService] 對話紀錄壓縮：{history_stats}")
+        return recent_history
+
+    @staticmethod
+    def _cached_response(cache_key):
+        cached = response_cache.get(cache_key)
+        metrics.response_cache_total.inc(result="miss" if cached is None else "hit")
+        metrics.annotate(cache="miss" if cached is None else "hit")
+        if cached is not None:
+            print(f"[ChatService] 命中回應快取 ({cache_key[:8]})")
+        return cached
+
+    @staticmethod
+    def _retrieve_context(query):
+        """執行 RAG 檢索 (依相關度排序，並限制注入的 Token 數量)，回傳 context_info"""
+        with metrics.stage("rag"):
+            rag_pieces = select_social_knowledge(query)
+            context_info = assemble_context(rag_pieces)
+        if rag_pieces:
+            scores = ", ".join(f"{p['kind']}#{p['index']}={p['score']}" for p in rag_pieces)
+            print(f"[ChatService] RAG 選用 {len(rag_pieces)} 則知識：{scores}")
+        return context_info
+
+    @staticmethod
+    def _build_messages(user_text, processed_image, recent_history, route, context_info=None):
+        """組裝送往 OpenAI 的 messages (含 RAG 知識、對話紀錄與圖片)；批次請求會傳入共用的 context_info"""
+        # 3. 執行 RAG 檢索
+        if context_info is None:
+            context_info = ChatService._retrieve_context(user_text)
+
+        # 4. 靜態 System Prompt 在最前 (觸發上游 Prompt Caching)，再接對話紀錄與在地化知識
+        started = time.perf_counter()
+        messages, segment_tokens = build_prompt_messages(context_info, recent_history, route["prompt"])
+
+        # 5. 構建當前的使用者輸入內容
+        user_content = []
+        if user_text:
+            user_content.append({"type": "text", "text": user_text})
+        elif processed_image:
+            # 若僅有圖片，給予預設指令
+            user_content.append({"type": "text", "text": "請幫我分析這張截圖的社交脈絡。"})
+
+        # 6. 附上壓縮後的圖片 (維持你的效能優化邏輯，壓縮已在 _prepare_image 完成)
+        if processed_image:
+            compressed_image = processed_image["image"]
+            user_content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{compressed_image}",
+                    "detail": "high" # 確保 AI 能看清截圖文字
+                }
+            })
+
+        messages.append({"role": "user", "content": user_content})
+        segment_tokens["user"] = estimate_tokens(user_text or "")
+        metrics.observe_stage("prompt", time.perf_counter() - started)
+
+        for segment, tokens in segment_tokens.items():
+            metrics.prompt_tokens_total.inc(tokens, segment=segment)
+        metrics.prompt_tokens.observe(sum(segment_tokens.values()))
+        metrics.annotate(prompt_tokens=segment_tokens)
+        return messages
+
+    @staticmethod
+    def _completion_options(route, messages):
+        """依請求類別組出 chat.completions.create 的參數 (延遲預算由呼叫端的期限控管)"""
+        options = {
+            "model": route["model"],
+            "messages": messages,
+            "response_format": {"type": "json_object"},  # 確保輸出格式
+            "temperature": route["temperature"],
+        }
+        if route["max_tokens"]:
+            options["max_tokens"] = route["max_tokens"]
+        return options
+
+    @staticmethod
+    async def _complete(route, messages):
+        """
+        非串流呼叫上游。超過該類別近期 p95 延遲仍未完成、且還有空的上游名額與對沖預算時，
+        再送出一次相同請求，採用先完成的結果。
+        """
+        hedge_launched = []
+        attempts = []
+
+        async def attempt():
+            # 只有主要呼叫在被取消時記錄設限樣本：對沖呼叫晚了 hedge delay 才送出，
+            # 落敗時經過的時間遠小於實際延遲，記入會把 p95 往下拉
+            primary = not attempts
+            attempts.append(True)
+            async with upstream_slot(route["pool"]):
+                with ChatService._upstream_timer(route, censor=primary):
+                    return await (await get_client_async()).chat.completions.create(
+                        **ChatService._completion_options(route, messages)
+                    )
+
+        def may_hedge():
+            if upstream_has_capacity(route["pool"]) and latency_tracker.try_acquire_hedge():
+                hedge_launched.append(True)
+                return True
+            return False
+
+        response, winner = await hedged(attempt, latency_tracker.hedge_delay(route["name"]), may_hedge)
+        if hedge_launched:
+            metrics.hedged_requests_total.inc(route=route["name"], winner=winner)
+            metrics.annotate(hedge=winner)
+        return response
+
+    @staticmethod
+    async def _stream_upstream(route, messages, chunks):
+        """接收上游串流並把文字片段放進 chunks，結束 (或失敗) 時放入 None；回傳 finish_reason"""
+        finish_reason = None
+        try:
+            # 串流期間持續佔用一個上游名額，直到整段輸出結束
+            async with upstream_slot(route["pool"]):
+                with ChatService._upstream_timer(route) as started:
+                    first_token = True
+                    stream = await (await get_client_async()).chat.completions.create(
+                        **ChatService._completion_options(route, messages), stream=True
+                    )
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        finish_reason = getattr(chunk.choices[0], "finish_reason", None) or finish_reason
+                        text = chunk.choices[0].delta.content
+                        if not text:
+                            continue
+                        if first_token:
+                            metrics.observe_stage("llm_first_token", time.perf_counter() - started)
+                            first_token = False
+                        chunks.put_nowait(text)
+        finally:
+            chunks.put_nowait(None)
+        return finish_reason
+
+    @staticmethod
+    def _remaining(started, route):
+        """距離請求期限 (開始時間 + 該類別的延遲預算) 還剩幾秒"""
+        return max(0.0, started + route["latency_budget"] - time.perf_counter())
+
+    @staticmethod
+    def _deadline_fallback(user_text, history, route):
+        """超過期限：改用只依知識庫組出的在地備援回覆 (不寫入快取，下次仍會重新呼叫上游)"""
+        print(f"[ChatService] {route['name']} 超過 {route['latency_budget']}s 期限，改用在地備援回覆")
+        metrics.fallback_responses_total.inc(reason="deadline")
+        metrics.annotate(fallback="deadline")
+        # fallback 標記讓 Session 不把這則備援回覆當成真正的 LittleTone 回合保存
+        return {**build_local_response(user_text, history), "fallback": "deadline"}
+
+    @staticmethod
+    def _length_fallback(user_text, history, route):
+        """輸出達到 max_tokens 上限被截斷：JSON 不完整，改用在地備援回覆 (不寫入快取)"""
+        print(f"[ChatService] {route['name']} 輸出長度達到上限被截斷 (finish_reason=length)，改用在地備援回覆")
+        metrics.fallback_responses_total.inc(reason="length")
+        metrics.annotate(fallback="length")
+        return {**build_local_response(user_text, history), "fallback": "length"}
+
+    @staticmethod
+    @contextmanager
+    def _upstream_timer(route, censor=True):
+        """
+        計時一次上游呼叫。censor 為 True 時，被取消 (超過期限 / 對沖落敗) 或逾時的呼叫也記入
+        對沖用的延遲樣本，以已經過的時間作為下限 (設限樣本)，否則最慢的那些呼叫永遠不會出現在 p95 裡。
+        """
+        started = time.perf_counter()
+        try:
+            yield started
+        except asyncio.CancelledError:
+            if censor:
+                latency_tracker.observe(route["name"], time.perf_counter() - started)
+            raise
+        except Exception as e:
+            # openai 採延遲匯入，以類別名稱辨識其逾時例外
+            if censor and (isinstance(e, asyncio.TimeoutError) or type(e).__name__ == "APITimeoutError"):
+                latency_tracker.observe(route["name"], time.perf_counter() - started)
+            raise
+        ChatService._observe_upstream(route, time.perf_counter() - started)
+
+    @staticmethod
+    def _observe_upstream(route, seconds):
+        """記錄上游耗時：整體 llm_total 階段 + 各請求類別的延遲分布與超出預算次數"""
+        latency_tracker.observe(route["name"], seconds)
+        metrics.observe_stage("llm_total", seconds)
+        metrics.route_upstream_seconds.observe(seconds, route=route["name"])
+        if seconds > route["latency_budget"]:
+            metrics.route_over_budget_total.inc(route=route["name"])
+
     @staticmethod
     def _parse_json_content(content: str) -> dict:
         """
         解析並清理 AI 回傳的 JSON，移除可能干擾的標籤。
         """
-        try:
-            # 採納組員的正規表達式清理機制
-            clean_str = re.sub(r"```json\n?|\n?```", "", content).strip()
-            return json.loads(clean_str)
-        except Exception:
-            return ChatService._get_error_response()
+        with metrics.stage("parse_json"):
+            try:
+                # 採納組員的正規表達式清理機制
+                clean_str = re.sub(r"```json\n?|\n?```", "", content).strip()
+                return json.loads(clean_str)
+            except Exception:
+                metrics.fallback_responses_total.inc(reason="invalid_json")
+                return ChatService._get_error_response()
+
+    @staticmethod
+    def _prompt_version() -> str:
+        """Prompt 模板版本 + 知識庫版本，作為回應快取 Key 的一部分"""
+        global _prompt_version
+        if _prompt_version is None:
+            _prompt_version = digest_bytes(PROMPT_VERSION + knowledge_version())
+        return _prompt_version
+
+    @staticmethod
+    def _is_error_response(result) -> bool:
+        return not isinstance(result, dict) or result.get("analysis") == "Error"
 
     @staticmethod
     def _get_error_response() -> dict:
@@ -91,4 +600,6 @@ class ChatService:
         }
 
 # 確保 app.py 的調用接口正常運作
-get_little_tone_final_response = ChatService.get_little_tone_final_response
\ No newline at end of file
+get_little_tone_final_response = ChatService.get_little_tone_final_response
+stream_little_tone_response = ChatService.stream_little_tone_response
+stream_batch_responses = ChatService.stream_batch_responses
\ No newline at end of file
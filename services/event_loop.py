@@ -0,0 +1,67 @@
+import asyncio
+import contextvars
+import os
+import threading
+
+
+async def _run_in_context(coro, context):
+    # 在呼叫端的 contextvars 內建立 Task，Flask 的 request / g 才能在協程中正常使用
+    task = context.run(asyncio.ensure_future, coro)
+    return await task
+
+
+class SharedEventLoop:
+    """
+    每個 worker 行程共用一個長駐的事件迴圈 (跑在背景執行緒)。
+    flask[async] 預設每個請求都開一個新的事件迴圈，導致 AsyncOpenAI 的連線池無法重用、
+    每次都要重新 TLS 握手；改由這裡統一執行所有協程，連線池與上游並行上限才有意義。
+    """
+
+    def __init__(self, name="littletone-event-loop"):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get_loop(self):
+        # gunicorn --preload 會在 fork 後沿用父行程的物件，需依 pid 重新建立
+        if self._loop is None or self._pid != os.getpid():
+            with self._lock:
+                if self._loop is None or self._pid != os.getpid():
+                    self._start()
+        return self._loop
+
+    def _start(self):
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            ready.set()
+            loop.run_forever()
+
+        thread = threading.Thread(target=run, name=self.name, daemon=True)
+        thread.start()
+        ready.wait()
+        self._loop, self._thread, self._pid = loop, thread, os.getpid()
+
+    def run(self, coro, timeout=None):
+        """在共用事件迴圈上執行協程，並於目前執行緒等待結果"""
+        loop = self.get_loop()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("SharedEventLoop.run() 不可在事件迴圈執行緒內呼叫，請直接 await")
+
+        future = asyncio.run_coroutine_threadsafe(
+            _run_in_context(coro, contextvars.copy_context()), loop
+        )
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+
+# 全域共用的事件迴圈
+shared_loop = SharedEventLoop()
@@ -0,0 +1,135 @@
+import re
+
+from .rag_service import get_knowledge_base, select_social_knowledge
+from .request_router import is_tone_instruction
+
+# --- 在地備援回覆 ---
+# 上游超過期限時，只用知識庫 (情緒場景 + 在地詞彙) 組出與 GPT 相同格式的 JSON，
+# 不呼叫任何外部服務，毫秒內即可回應
+FALLBACK_MAX_OPTIONS = 3
+SAFETY_KEYWORDS = ("想死", "自殺", "不想活")
+# AI 應對方針中出現這些字樣時，『』內是給使用者的提醒；否則視為可直接使用的回覆範例
+ADVICE_MARKERS = ("提示", "提醒", "建議使用者")
+
+_QUOTE_PATTERN = re.compile(r"『([^』]+)』")
+_SENTENCE_END = re.compile(r"[。！]")
+# 詞彙建議句尾的說明括號，例如「（主動邀約測試意願）」
+_NOTE_PATTERN = re.compile(r"（([^）]+)）\s*$")
+
+
+def _fallback_query(user_text, history):
+    """決定檢索用的查詢：語氣改寫指令改用對話紀錄中最後一則一般使用者訊息"""
+    if user_text and not is_tone_instruction(user_text):
+        return user_text
+    for message in reversed(history or []):
+        if not isinstance(message, dict) or message.get("role") != "user":
+            continue
+        content = message.get("content")
+        if isinstance(content, str) and not is_tone_instruction(content):
+            return content
+    return ""
+
+
+def _quotes(text):
+    return [quote.strip() for quote in _QUOTE_PATTERN.findall(text or "") if quote.strip()]
+
+
+def _term_option(item):
+    """在地詞彙的推薦用法 → 快捷按鈕 (標題取括號說明，沒有時使用詞彙本身)"""
+    suggestion = (item.get("suggestions") or [""])[0]
+    quotes = _quotes(suggestion)
+    if not quotes:
+        return None
+    note = _NOTE_PATTERN.search(suggestion)
+    title = note.group(1) if note else f"「{item['term']}」的用法"
+    return {"title": title, "example": quotes[0]}
+
+
+def build_local_response(user_text, history=None):
+    """
+    依命中的情緒場景 (文化脈絡、真實情緒、AI 應對方針) 與在地詞彙 (語氣建議、推薦用法)
+    組出降級回覆；欄位與 GPT 的 JSON 輸出相同 (reply / key_change / suggested_scenarios ...)
+    """
+    query = _fallback_query(user_text, history)
+    pieces = select_social_knowledge(query) if query else []
+    kb = get_knowledge_base()
+    scenarios = [kb.scenarios[p["index"]] for p in pieces if p["kind"] == kb.SCENARIO]
+    terms = [kb.terms[p["index"]] for p in pieces if p["kind"] == kb.TERM]
+
+    # 安全機制優先：不套用任何場景解讀 (例如把「想死」當成玩笑話)
+    if any(keyword in query for keyword in SAFETY_KEYWORDS):
+        return {
+            "status": "ready",
+            "need_more_info": False,
+            "reply": "聽起來你現在真的很辛苦...謝謝你願意說出來。如果你覺得撐不住，"
+                     "請撥打 1925 安心專線或 1995 生命線，會有人陪你聊聊，你不是一個人 🌱",
+            "suggested_scenarios": [],
+            "key_change": "💡 核心洞察：你的感受很重要，先照顧好自己。",
+            "analysis": "偵測到可能的危機字詞，先提供求助資源。",
+            "tip": "也可以找一位信任的朋友或家人，讓他知道你現在的狀況。",
+            "safety_alert": True,
+        }
+
+    if not scenarios and not terms:
+        return {
+            "status": "diagnosing",
+            "need_more_info": True,
+            "reply": "不好意思，我這次想得比較久...可以再多跟我說一點嗎？像是對方是誰、發生了什麼事，我會更好幫你出主意喔 🌱",
+            "suggested_scenarios": [],
+            "key_change": "💡 核心洞察：先把關係與事件釐清，才能給出最貼切的回覆。",
+            "analysis": "目前先以在地知識庫提供簡短回應，補充細節後可以再試一次。",
+            "tip": "描述時可以附上對方的原話或截圖，判斷語氣會更準確。",
+        }
+
+    reply_parts = ["不好意思讓你久等了，我先依照類似的情境整理了一些方向給你參考："]
+    options = []
+    key_change = ""
+    analysis_parts = []
+    tip = ""
+
+    if scenarios:
+        scene = scenarios[0]
+        context = scene.get("contextual_analysis", {})
+        emotion = context.get("correct_emotion")
+        naive = scene.get("naive_interpretation")
+        if emotion:
+            reply_parts.append(f"對方這句話比較可能是「{emotion}」的意思。")
+            if naive:
+                key_change = f"💡 核心洞察：表面看起來像「{naive.rstrip('。')}」，但其實更接近「{emotion}」。"
+        # AI 應對方針中只有『』內的文字是給使用者看的，其餘是給模型的指示
+        guideline = scene.get("ai_action_guideline") or ""
+        guideline_quotes = _quotes(guideline)
+        if guideline_quotes:
+            prefix = _SENTENCE_END.split(guideline.split("『", 1)[0])[-1]
+            if any(marker in prefix for marker in ADVICE_MARKERS):
+                reply_parts.append(f"我的建議是：{guideline_quotes[0]}")
+            else:
+                options.append({"title": "參考回覆", "example": guideline_quotes[0]})
+        if context.get("cultural_clue"):
+            analysis_parts.append(context["cultural_clue"])
+        tip = scene.get("localization_note") or ""
+
+    if terms and not scenarios:
+        reply_parts.append(f"先幫你確認一下「{terms[0]['term']}」的意思：{terms[0].get('definition', '')}")
+
+    for item in terms:
+        option = _term_option(item)
+        if option:
+            options.append(option)
+        if item.get("definition"):
+            analysis_parts.append(f"「{item['term']}」：{item['definition']}")
+        if not tip and item.get("tone_advice"):
+            tip = item["tone_advice"]
+
+    if options:
+        reply_parts.append("下面也有幾個可以直接複製使用的說法。")
+
+    return {
+        "status": "ready",
+        "need_more_info": False,
+        "reply": "".join(reply_parts),
+        "suggested_scenarios": options[:FALLBACK_MAX_OPTIONS],
+        "key_change": key_change or "💡 核心洞察：先參考在地用語的語氣，再決定怎麼回比較自然。",
+        "analysis": "\n".join(analysis_parts),
+        "tip": tip or "不確定對方語氣時，先用輕鬆的方式回應，再觀察對方的反應。",
+    }
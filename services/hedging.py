@@ -0,0 +1,107 @@
+import asyncio
+import math
+import os
+import threading
+from collections import deque
+
+# --- 對沖請求 (Hedged Request) 設定 ---
+# 上游呼叫超過該請求類別近期的 p95 延遲仍未完成時，再送出一次相同請求，採用先完成的結果
+UPSTREAM_HEDGING = os.getenv("UPSTREAM_HEDGING", "1") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+# 每個類別保留最近幾筆延遲；樣本數不足時不對沖 (p95 還不可信)
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+# 對沖延遲的下限 (秒)，避免極快的類別一送出就重送
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+# 對沖次數最多佔上游呼叫的比例，上游整體變慢時不會因此加倍流量
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+
+
+class LatencyTracker:
+    """
+    依請求類別保存最近的上游延遲 (固定長度的滑動視窗)，
+    並計算對沖延遲與控管對沖預算。
+    """
+
+    def __init__(self, window=HEDGE_WINDOW, min_samples=HEDGE_MIN_SAMPLES, max_ratio=HEDGE_MAX_RATIO):
+        self.window = window
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._hedges = 0
+
+    def observe(self, key, seconds):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self._calls += 1
+
+    def percentile(self, key, q=HEDGE_PERCENTILE):
+        """最近樣本的第 q 百分位數 (nearest-rank)；樣本不足時回傳 None"""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        rank = max(1, math.ceil(q / 100 * len(samples)))
+        return samples[rank - 1]
+
+    def hedge_delay(self, key):
+        """送出對沖請求前要等待的秒數；關閉或樣本不足時回傳 None (不對沖)"""
+        if not UPSTREAM_HEDGING:
+            return None
+        p95 = self.percentile(key)
+        if p95 is None:
+            return None
+        return max(HEDGE_MIN_DELAY, p95)
+
+    def try_acquire_hedge(self):
+        """檢查對沖預算：已送出的對沖次數不超過上游呼叫的 max_ratio"""
+        with self._lock:
+            if self._hedges + 1 > self._calls * self.max_ratio:
+                return False
+            self._hedges += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self._calls,
+                "hedges": self._hedges,
+                "hedge_rate": round(self._hedges / self._calls, 4) if self._calls else 0.0,
+            }
+
+
+async def hedged(attempt, delay, may_hedge=None):
+    """
+    執行 attempt() (回傳 coroutine 的函式)；超過 delay 秒仍未完成且 may_hedge() 允許時，
+    再啟動一次相同的 attempt，採用第一個成功的結果並取消另一個。
+    回傳 (結果, 結果來源)，來源為 "primary" 或 "hedge"；兩者都失敗時拋出最後一個例外。
+    """
+    primary = asyncio.ensure_future(attempt())
+    tasks = [primary]
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and (may_hedge is None or may_hedge()):
+                tasks.append(asyncio.ensure_future(attempt()))
+
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), "primary" if task is primary else "hedge"
+                error = task.exception()
+        raise error
+    finally:
+        # 呼叫端被取消 (例如超過期限) 或已有結果時，收回尚未完成的呼叫
+        for task in tasks:
+            task.cancel()
+
+
+latency_tracker = LatencyTracker()
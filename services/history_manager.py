@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from .tokens import estimate_tokens
+
+# --- 對話紀錄預算 (皆可由環境變數調整) ---
+# 原文保留的對話紀錄總 Token 上限 (不含摘要)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1200"))
+# 最多保留幾則原文訊息 (即使每則都很短)
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "8"))
+# 單則訊息的 Token 上限，超過時只保留頭尾
+HISTORY_ENTRY_MAX_TOKENS = int(os.getenv("HISTORY_ENTRY_MAX_TOKENS", "400"))
+# 較早對話摘要的 Token 上限，超過時保留開頭幾行 (通常交代了對象與事件)，從中間捨棄
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "300"))
+HISTORY_SUMMARY_HEAD_LINES = int(os.getenv("HISTORY_SUMMARY_HEAD_LINES", "2"))
+# 摘要中每則訊息保留的字數
+HISTORY_SUMMARY_LINE_CHARS = int(os.getenv("HISTORY_SUMMARY_LINE_CHARS", "60"))
+# 只處理最新的幾則訊息，再舊的內容直接省略，確保超長對話的處理時間仍有上限
+HISTORY_MAX_INPUT_MESSAGES = int(os.getenv("HISTORY_MAX_INPUT_MESSAGES", "100"))
+# 摘要快取筆數 (每段對話約佔 1 筆)
+HISTORY_SUMMARY_CACHE_ENTRIES = int(os.getenv("HISTORY_SUMMARY_CACHE_ENTRIES", "4096"))
+
+_ROLES = {"user": "使用者", "assistant": "LittleTone"}
+SUMMARY_HEADER = "【先前對話摘要】以下為較早的對話重點，僅供理解脈絡："
+SUMMARY_OMITTED = "…(中間的對話已省略)"
+SHRINK_MARKER = "\n…(中間內容過長已省略)…\n"
+
+
+def _message_text(message):
+    """取出訊息的純文字內容；助理回覆若是完整 JSON，只取 reply 欄位"""
+    content = message.get("content")
+    if isinstance(content, list):
+        # 多模態內容只保留文字部分，舊截圖不再重送
+        content = "\n".join(
+            part.get("text", "") for part in content
+            if isinstance(part, dict) and part.get("type") == "text"
+        )
+    if not isinstance(content, str):
+        return ""
+    content = content.strip()
+    if message.get("role") == "assistant" and content.startswith("{"):
+        try:
+            reply = json.loads(content).get("reply")
+            if isinstance(reply, str):
+                content = reply.strip()
+        except (ValueError, AttributeError):
+            pass
+    return content
+
+
+def _shrink(text, max_tokens):
+    """超過上限的訊息保留開頭與結尾 (通常是最重要的部分)"""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text, tokens
+    # 依比例估算需保留的字數，再逐步縮短直到符合上限
+    keep = max(1, len(text) * max_tokens // tokens)
+    while keep > 1:
+        head = keep * 2 // 3
+        shrunk = text[:head].rstrip() + SHRINK_MARKER + text[len(text) - (keep - head):].lstrip()
+        shrunk_tokens = estimate_tokens(shrunk)
+        if shrunk_tokens <= max_tokens:
+            return shrunk, shrunk_tokens
+        keep = keep * 4 // 5
+    return text[:1], 1
+
+
+def _summary_line(message):
+    text = " ".join(message["content"].split())
+    if len(text) > HISTORY_SUMMARY_LINE_CHARS:
+        text = text[:HISTORY_SUMMARY_LINE_CHARS] + "…"
+    return f"- {_ROLES[message['role']]}：{text}"
+
+
+def _chain_digest(previous, message):
+    raw = f"{previous}\x00{message['role']}\x00{message['content']}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class HistoryManager:
+    """
+    依 Token 預算壓縮前端送來的對話紀錄：
+    1. 清理：只留 user / assistant 的文字，過長的單則訊息保留頭尾
+    2. 由新到舊保留符合預算的原文訊息
+    3. 更早的訊息收斂成一段摘要 (本地擷取，不呼叫上游)
+
+    摘要以「訊息鏈雜湊」快取：同一段對話每多一輪，只需把新被擠出的訊息接到
+    既有摘要後面，不必從頭重算。
+    """
+
+    def __init__(self, token_budget=HISTORY_TOKEN_BUDGET, max_messages=HISTORY_MAX_MESSAGES,
+                 entry_max_tokens=HISTORY_ENTRY_MAX_TOKENS, summary_max_tokens=HISTORY_SUMMARY_MAX_TOKENS,
+                 summary_head_lines=HISTORY_SUMMARY_HEAD_LINES, cache_entries=HISTORY_SUMMARY_CACHE_ENTRIES):
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self.entry_max_tokens = entry_max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.summary_head_lines = summary_head_lines
+        self.cache_entries = cache_entries
+        self._summaries = OrderedDict()  # 訊息鏈雜湊 -> (摘要行, 各行 Token 數)
+        self._lock = threading.Lock()
+        self._hits = 0          # 摘要完全命中
+        self._extends = 0       # 沿用既有摘要，只補上新擠出的訊息
+        self._misses = 0        # 從頭建立
+
+    def compact(self, history):
+        """
+        回傳 (messages, stats)：messages 可直接放入 Prompt (摘要在前、原文在後)，
+        stats 含原文 / 摘要 Token 數與被摘要、被捨棄的訊息數。
+        """
+        messages, shrunk = self._clean(history)
+
+        # 由新到舊挑選原文訊息；最新一則即使超過預算也保留 (已被縮短過)
+        kept_tokens = 0
+        split = len(messages)
+        while split > 0 and len(messages) - split < self.max_messages:
+            tokens = messages[split - 1]["tokens"]
+            if split < len(messages) and kept_tokens + tokens > self.token_budget:
+                break
+            kept_tokens += tokens
+            split -= 1
+
+        # 讓保留的原文從使用者的訊息開始，避免開頭是一則沒有上下文的助理回覆
+        if split < len(messages) - 1 and messages[split]["role"] == "assistant":
+            kept_tokens -= messages[split]["tokens"]
+            split += 1
+
+        result = []
+        summary_tokens = 0
+        if split > 0:
+            summary = self._summarize(messages[:split])
+            summary_tokens = estimate_tokens(summary)
+            result.append({"role": "system", "content": summary})
+        result.extend({"role": m["role"], "content": m["content"]} for m in messages[split:])
+
+        stats = {
+            "kept": len(messages) - split,
+            "summarized": split,
+            "shrunk": shrunk,
+            # 非 list 的輸入 (例如字串) 不是訊息，整個忽略，不算捨棄了幾則
+            "dropped": (len(history) if isinstance(history, list) else 0) - len(messages),
+            "history_tokens": kept_tokens,
+            "summary_tokens": summary_tokens,
+        }
+        return result, stats
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._extends + self._misses
+            return {
+                "summary_hits": self._hits,
+                "summary_extends": self._extends,
+                "summary_misses": self._misses,
+                "summary_reuse_rate": round((self._hits + self._extends) / total, 4) if total else 0.0,
+                "summary_entries": len(self._summaries),
+            }
+
+    def _clean(self, history):
+        messages = []
+        shrunk = 0
+        if not isinstance(history, list):
+            return messages, shrunk
+        for message in history[-HISTORY_MAX_INPUT_MESSAGES:]:
+            if not isinstance(message, dict) or message.get("role") not in _ROLES:
+                continue
+            text = _message_text(message)
+            if not text:
+                continue
+            content, tokens = _shrink(text, self.entry_max_tokens)
+            if content is not text:
+                shrunk += 1
+            messages.append({"role": message["role"], "content": content, "tokens": tokens})
+        return messages, shrunk
+
+    def _summarize(self, messages):
+        # 逐則計算訊息鏈雜湊，找出已快取的最長前綴
+        digests = []
+        previous = ""
+        for message in messages:
+            previous = _chain_digest(previous, message)
+            digests.append(previous)
+
+        start, lines, line_tokens = 0, [], []
+        with self._lock:
+            for i in range(len(digests) - 1, -1, -1):
+                cached = self._summaries.get(digests[i])
+                if cached is not None:
+                    self._summaries.move_to_end(digests[i])
+                    start, lines, line_tokens = i + 1, list(cached[0]), list(cached[1])
+                    break
+            if start == len(messages):
+                self._hits += 1
+            elif start:
+                self._extends += 1
+            else:
+                self._misses += 1
+
+        # 只處理新被擠出預算的訊息；超過摘要上限時保留開頭幾行與最新一行，從中間捨棄
+        total = sum(line_tokens)
+        for message in messages[start:]:
+            line = _summary_line(message)
+            tokens = estimate_tokens(line)
+            lines.append(line)
+            line_tokens.append(tokens)
+            total += tokens
+            while total > self.summary_max_tokens and len(lines) > 1:
+                index = min(self.summary_head_lines, len(lines) - 2)
+                total -= line_tokens.pop(index)
+                lines.pop(index)
+        omitted = len(messages) > len(lines)
+
+        with self._lock:
+            self._summaries[digests[-1]] = (tuple(lines), tuple(line_tokens))
+            self._summaries.move_to_end(digests[-1])
+            while len(self._summaries) > self.cache_entries:
+                self._summaries.popitem(last=False)
+
+        head = lines[:self.summary_head_lines]
+        body = "\n".join(head + ([SUMMARY_OMITTED] if omitted else []) + lines[len(head):])
+        return f"{SUMMARY_HEADER}\n{body}"
+
+
+# 全域共用的對話紀錄管理器
+history_manager = HistoryManager()
@@ -1,8 +1,229 @@
+import asyncio
 import base64
-from PIL import Image
+import binascii
+import hashlib
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import io
 
+from . import metrics
+
+# --- 壓縮參數 ---
+# 截圖在長邊 800px 下 GPT-4o 仍能清楚辨識文字，但 Token 消耗會大幅降低
+MAX_SIZE = 800
+JPEG_QUALITY = 70
+# 已經是 JPEG、尺寸夠小且檔案不大時，直接沿用原檔不再重新編碼
+PASSTHROUGH_MAX_BYTES = int(os.getenv("IMAGE_PASSTHROUGH_MAX_BYTES", str(200 * 1024)))
+
+# --- 執行緒池與背壓設定 ---
+# Pillow 在解碼 / 縮放 / 編碼時會釋放 GIL，因此執行緒池即可平行處理，且不會卡住事件迴圈
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# 同時「執行中 + 排隊中」的圖片上限；滿了就等待空位，超過時間則放棄
+IMAGE_QUEUE_SIZE = int(os.getenv("IMAGE_QUEUE_SIZE", "8"))
+IMAGE_QUEUE_TIMEOUT = float(os.getenv("IMAGE_QUEUE_TIMEOUT", "10"))
+
+# --- 截圖去重快取 ---
+# dHash 邊長 (16 -> 256 bits)；文字截圖細節多，邊長太小容易把不同對話誤判為同一張
+IMAGE_HASH_SIZE = int(os.getenv("IMAGE_HASH_SIZE", "16"))
+# 驗證用灰階縮圖的寬度，以及兩張縮圖允許的最大像素差 (重新存檔約 1~2，改一個字通常 > 50)
+IMAGE_SIGNATURE_WIDTH = int(os.getenv("IMAGE_SIGNATURE_WIDTH", "128"))
+IMAGE_MATCH_MAX_DIFF = int(os.getenv("IMAGE_MATCH_MAX_DIFF", "24"))
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "256"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-service")
+# 依事件迴圈分開的排隊名額 (正常情況下只有共用事件迴圈這一個)
+_slots = weakref.WeakKeyDictionary()
+
+def _queue_slots(loop):
+    slots = _slots.get(loop)
+    if slots is None:
+        slots = _slots[loop] = asyncio.Semaphore(IMAGE_WORKERS + IMAGE_QUEUE_SIZE)
+    return slots
+
+def _release_slot(loop, slots):
+    # 由執行緒池的工作結束時呼叫；asyncio.Semaphore 不是執行緒安全的，交回事件迴圈歸還
+    try:
+        loop.call_soon_threadsafe(slots.release)
+    except RuntimeError:
+        pass  # 事件迴圈已關閉，名額也隨之失效
+
+class ScreenshotCache:
+    """
+    以感知雜湊為索引的壓縮結果快取：同一張 (或重新存檔過的) 截圖只壓縮一次。
+    dHash 相同的候選還要再比對一張低解析度灰階縮圖，避免只差幾個字的對話截圖被誤判為同一張。
+    以筆數與總位元組數限制記憶體，超過時淘汰最久未使用的項目。
+    """
+
+    def __init__(self, max_entries=IMAGE_CACHE_MAX_ENTRIES, max_bytes=IMAGE_CACHE_MAX_BYTES,
+                 max_pixel_diff=IMAGE_MATCH_MAX_DIFF):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_pixel_diff = max_pixel_diff
+        # digest -> (compressed_str, 驗證縮圖, 壓縮耗時秒數)
+        self._entries = OrderedDict()
+        self._by_hash = {}  # dHash -> [digest, ...]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._saved_seconds = 0.0
+
+    def find(self, phash, signature):
+        """回傳與此截圖視為相同的 (digest, compressed_str, 省下的壓縮秒數)；找不到時回傳 None"""
+        with self._lock:
+            for digest in self._by_hash.get(phash, ()):
+                compressed, cached_signature, elapsed = self._entries[digest]
+                if self._same_picture(signature, cached_signature):
+                    self._entries.move_to_end(digest)
+                    self._hits += 1
+                    self._saved_seconds += elapsed
+                    return digest, compressed, elapsed
+            self._misses += 1
+            return None
+
+    def put(self, phash, digest, signature, compressed_str, elapsed):
+        size = len(compressed_str) + signature.width * signature.height
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if digest in self._entries:
+                self._remove(digest)
+            self._entries[digest] = (compressed_str, signature, elapsed)
+            self._by_hash.setdefault(phash, []).append(digest)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "saved_seconds": round(self._saved_seconds, 3),
+                "evictions": self._evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _same_picture(self, signature, cached_signature):
+        if signature.size != cached_signature.size:
+            return False
+        from PIL import ImageChops
+
+        _, max_diff = ImageChops.difference(signature, cached_signature).getextrema()
+        return max_diff <= self.max_pixel_diff
+
+    def _remove(self, digest):
+        compressed, signature, _ = self._entries.pop(digest)
+        self._bytes -= len(compressed) + signature.width * signature.height
+        phash = digest.rsplit(":", 1)[0]
+        siblings = self._by_hash.get(phash, [])
+        if digest in siblings:
+            siblings.remove(digest)
+        if not siblings:
+            self._by_hash.pop(phash, None)
+
+# 全域共用的截圖快取
+screenshot_cache = ScreenshotCache()
+
 class ImageService:
+    @staticmethod
+    async def process_screenshot_async(base64_str, timeout=IMAGE_QUEUE_TIMEOUT):
+        """
+        非同步版本：把雜湊與壓縮工作丟到有上限的執行緒池，避免阻塞事件迴圈上的其他請求。
+        佇列已滿時會等待空位 (最多 timeout 秒)，仍無空位則回傳 None。
+        """
+        if not base64_str:
+            return None
+
+        loop = asyncio.get_running_loop()
+        slots = _queue_slots(loop)
+        try:
+            # 在事件迴圈上等待空位，等待中被取消也不會佔住名額
+            await asyncio.wait_for(slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            print("[ImageService] 圖片處理佇列已滿，放棄本次壓縮")
+            return None
+
+        # 名額在執行緒池的工作真正結束時才歸還：呼叫端被取消時壓縮仍在跑，不能提早放出空位
+        future = _executor.submit(ImageService.process_screenshot, base64_str)
+        future.add_done_callback(lambda _: _release_slot(loop, slots))
+        return await asyncio.wrap_future(future, loop=loop)
+
+    @staticmethod
+    def process_screenshot(base64_str):
+        """
+        計算截圖的感知雜湊並取得壓縮結果 (優先使用快取)。
+        回傳 {"image": 壓縮後 Base64, "digest": 截圖摘要, "cache_hit": bool}；失敗時回傳 None。
+        digest 對重新存檔、輕微壓縮雜訊不敏感，可作為下游快取的 Key。
+        """
+        if not base64_str:
+            return None
+
+        try:
+            # 只解碼一次：雜湊與壓縮都使用同一張已縮小的圖片
+            img_data = base64.b64decode(base64_str)
+            decoded = ImageService.decode_for_compression(img_data)
+            phash, signature = ImageService.perceptual_signature(decoded[0], decoded[1])
+        except Exception as e:
+            print(f"[ImageService] 圖片雜湊計算失敗: {e}")
+            return None
+
+        found = screenshot_cache.find(phash, signature)
+        if found is not None:
+            digest, compressed, saved_seconds = found
+            metrics.screenshot_cache_total.inc(result="hit")
+            metrics.screenshot_cache_saved_seconds_total.inc(saved_seconds)
+            print(f"[ImageService] 命中截圖快取 ({digest[-8:]})，略過壓縮")
+            return {"image": compressed, "digest": digest, "cache_hit": True}
+
+        metrics.screenshot_cache_total.inc(result="miss")
+        started = time.perf_counter()
+        compressed = ImageService._compress_decoded(base64_str, img_data, decoded)
+        if compressed is None:
+            return None
+
+        # 摘要 = dHash + 驗證縮圖的雜湊，dHash 相同但內容不同的截圖仍會得到不同摘要
+        digest = f"{phash}:{hashlib.sha1(signature.tobytes()).hexdigest()[:12]}"
+        screenshot_cache.put(phash, digest, signature, compressed, time.perf_counter() - started)
+        return {"image": compressed, "digest": digest, "cache_hit": False}
+
+    @staticmethod
+    def perceptual_signature(img, original_size=None, hash_size=IMAGE_HASH_SIZE,
+                             signature_width=IMAGE_SIGNATURE_WIDTH):
+        """
+        由已解碼 (通常已縮小到壓縮尺寸) 的圖片同時取得：
+        - dHash：比較相鄰像素亮度，回傳 "原始寬x高:十六進位雜湊"
+        - 驗證縮圖：固定寬度的灰階縮圖，用來確認 dHash 相同的截圖內容真的一致
+        """
+        from PIL import Image
+
+        width, height = original_size or img.size
+        # 先以整數倍快速縮小再轉灰階，不必對整張圖做色彩轉換
+        factor = img.width // (signature_width * 2)
+        gray = (img.reduce(factor) if factor >= 2 else img).convert("L")
+        signature_height = max(1, round(signature_width * img.height / img.width))
+        signature = gray.resize((signature_width, signature_height), Image.BOX)
+
+        small = signature.resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels = small.tobytes()
+        bits = 0
+        row_width = hash_size + 1
+        for y in range(hash_size):
+            row = pixels[y * row_width:(y + 1) * row_width]
+            for x in range(hash_size):
+                bits = (bits << 1) | (row[x] > row[x + 1])
+        return f"{width}x{height}:{bits:0{hash_size * hash_size // 4}x}", signature
+
     @staticmethod
     def process_and_compress_base64(base64_str):
         """
@@ -13,28 +234,30 @@ class ImageService:
             return None
 
         try:
-            # 1. 將 Base64 解碼為圖片物件
+            # 1. 將 Base64 解碼為位元組
             img_data = base64.b64decode(base64_str)
-            img = Image.open(io.BytesIO(img_data))
-            
+        except (binascii.Error, ValueError) as e:
+            print(f"[ImageService] Base64 解碼失敗: {e}")
+            return None
+
+        return ImageService._compress_decoded(base64_str, img_data)
+
+    @staticmethod
+    def _compress_decoded(base64_str, img_data, decoded=None):
+        try:
             # 紀錄原始大小 (除錯用)
             original_size = len(base64_str)
 
-            # 2. 強制縮放：將長邊限制在 800px
-            # 截圖在此尺寸下 GPT-4o 仍能清楚辨識文字，但 Token 消耗會大幅降低
-            max_size = 800
-            if max(img.width, img.height) > max_size:
-                img.thumbnail((max_size, max_size), Image.LANCZOS)
-
-            # 3. 壓縮並轉檔
-            buffered = io.BytesIO()
-            # 轉成 RGB (避免 PNG 的透明層出錯) 並儲存為 JPEG
-            # quality=70 是兼顧清晰度與檔案大小的高CP值設定
-            img.convert("RGB").save(buffered, format="JPEG", quality=70, optimize=True)
-            
+            # 2~3. 縮放與壓縮 (已解碼時直接沿用)；若原檔已符合條件則直接沿用，省去 Base64 重新編碼
+            img, _, passthrough = decoded or ImageService.decode_for_compression(img_data)
+            if passthrough:
+                print("[ImageService] 圖片已是小尺寸 JPEG，略過重新壓縮")
+                return base64_str
+            compressed_bytes = ImageService.encode_jpeg(img)
+
             # 4. 重新編碼為 Base64
-            compressed_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            
+            compressed_str = base64.b64encode(compressed_bytes).decode('utf-8')
+
             # 紀錄壓縮後大小
             compressed_size = len(compressed_str)
             reduction = (1 - compressed_size / original_size) * 100
@@ -46,6 +269,56 @@ class ImageService:
             print(f"[ImageService] 圖片處理出錯: {e}")
             return None
 
+    @staticmethod
+    def compress_image_bytes(img_data, max_size=MAX_SIZE):
+        """
+        位元組進、位元組出的壓縮核心。
+        不需要處理時回傳「同一個」 img_data 物件，呼叫端可藉此判斷是否沿用原檔。
+        """
+        img, _, passthrough = ImageService.decode_for_compression(img_data, max_size)
+        if passthrough:
+            return img_data
+        return ImageService.encode_jpeg(img, max_size)
+
+    @staticmethod
+    def decode_for_compression(img_data, max_size=MAX_SIZE):
+        """
+        解碼時即做整數倍的快速縮小 (長邊不低於 max_size)，回傳 (圖片, 原始寬高, 是否可直接沿用原檔)。
+        感知雜湊與壓縮共用這張圖；較貴的 LANCZOS 收尾留到 encode_jpeg，命中快取時不必執行。
+        """
+        # Pillow 在第一張截圖進來時才載入，純文字請求與冷啟動都不必付出匯入成本
+        from PIL import Image
+
+        img = Image.open(io.BytesIO(img_data))
+        original_size = img.size
+        longest = max(img.width, img.height)
+        passthrough = (img.format == "JPEG" and img.mode in ("RGB", "L")
+                       and longest <= max_size and len(img_data) <= PASSTHROUGH_MAX_BYTES)
+
+        if longest > max_size:
+            if img.format == "JPEG":
+                # JPEG draft 模式：解碼時直接以 1/2、1/4、1/8 縮小，省下大量解碼成本
+                img.draft("RGB", (max_size, max_size))
+            else:
+                # 其他格式 (如 PNG 截圖) 用 reduce() 做整數倍的快速縮小，長邊仍不低於 max_size
+                factor = longest // max_size
+                if factor >= 2:
+                    img = img.reduce(factor)
+        return img, original_size, passthrough
+
+    @staticmethod
+    def encode_jpeg(img, max_size=MAX_SIZE):
+        from PIL import Image
+
+        if max(img.width, img.height) > max_size:
+            img.thumbnail((max_size, max_size), Image.LANCZOS)
+
+        # 轉成 RGB (避免 PNG 的透明層出錯) 並儲存為 JPEG
+        # quality=70 是兼顧清晰度與檔案大小的高CP值設定
+        buffered = io.BytesIO()
+        img.convert("RGB").save(buffered, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        return buffered.getvalue()
+
     def encode_local_image_to_base64(self, image_path):
         """
         (備用) 若需要讀取伺服器本地圖片時使用
@@ -55,4 +328,4 @@ class ImageService:
                 return base64.b64encode(image_file.read()).decode('utf-8')
         except Exception as e:
             print(f"[ImageService] 本地檔案讀取失敗: {e}")
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,49 @@
+"""
+知識庫編譯工具：預先建立語意檢索的向量索引，啟動時以 mmap 載入即可使用。
+
+    python -m services.kb_compiler
+
+產出 (預設在 data/index/)：
+- semantic_matrix.npy / semantic_idf.npy / semantic_meta.json：語意檢索的向量索引
+
+索引以知識片段內容的摘要為 Key，資料或片段渲染方式變動時執行期會偵測到並自動重建；
+唯讀環境 (如 Vercel) 則在背景執行緒於記憶體中重建 (約 0.1 秒)。
+關鍵字比對器建立只需約 20ms，與讀取預先序列化的檔案相差無幾，因此不另外輸出。
+"""
+import argparse
+import os
+import time
+
+from .rag_service import DICT_PATH, SCENARIO_PATH, RAG_INDEX_DIR, SocialKnowledgeBase
+
+
+def compile_knowledge_base(dict_path=DICT_PATH, scenario_path=SCENARIO_PATH):
+    """建立知識庫並寫出語意索引，回傳摘要資訊"""
+    started = time.perf_counter()
+    kb = SocialKnowledgeBase.from_files(dict_path, scenario_path)
+    index = kb.semantic_index()
+    return {
+        "terms": len(kb.terms),
+        "scenarios": len(kb.scenarios),
+        "keywords": len(kb.matcher),
+        "documents": len(index),
+        "version": kb.version,
+        "output": RAG_INDEX_DIR,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LittleTone 知識庫編譯工具")
+    parser.add_argument("--dict", default=DICT_PATH, help="在地詞彙 JSON 路徑")
+    parser.add_argument("--scenarios", default=SCENARIO_PATH, help="情緒場景 JSON 路徑")
+    args = parser.parse_args()
+
+    info = compile_knowledge_base(args.dict, args.scenarios)
+    print(f"[KB Compiler] 已編譯 {info['terms']} 個詞彙、{info['scenarios']} 個場景、"
+          f"{info['keywords']} 個關鍵字，語意索引 {info['documents']} 份文件 → "
+          f"{os.path.abspath(info['output'])} ({info['seconds']}s)")
+
+
+if __name__ == "__main__":
+    main()
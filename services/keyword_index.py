@@ -0,0 +1,93 @@
+from collections import deque
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick 多模式比對器：一次建表，之後只需線性掃描一次查詢字串，
+    即可找出所有命中的詞彙與關鍵字 (取代逐一 `kw in text` 的暴力比對)。
+    """
+
+    def __init__(self):
+        # 每個節點：子節點轉移表、失敗指標、以及在此結束的模式編號
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._patterns = []
+        self._payloads = []
+        self._pattern_ids = {}
+        self._built = False
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def items(self):
+        """逐一產生 (模式字串, payload 清單)，供計算文件頻率等統計使用"""
+        return zip(self._patterns, self._payloads)
+
+    def add(self, pattern, payload):
+        """加入一個模式；同一模式可綁定多個 payload (例如多個場景共用關鍵字)"""
+        if not pattern:
+            return
+        pattern_id = self._pattern_ids.get(pattern)
+        if pattern_id is None:
+            pattern_id = len(self._patterns)
+            self._pattern_ids[pattern] = pattern_id
+            self._patterns.append(pattern)
+            self._payloads.append([])
+
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(pattern_id)
+            self._built = False
+
+        self._payloads[pattern_id].append(payload)
+
+    def build(self):
+        """以 BFS 建立失敗指標，並把失敗鏈上的輸出合併到各節點"""
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                if self._out[self._fail[nxt]]:
+                    self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+        self._built = True
+        return self
+
+    def iter_matches(self, text):
+        """逐一產生 (結束位置, 模式字串, payload 清單)"""
+        if not self._built:
+            self.build()
+
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for index, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pattern_id in out[node]:
+                yield index, self._patterns[pattern_id], self._payloads[pattern_id]
+
+    def find_payloads(self, text):
+        """回傳所有命中的 payload (去重)"""
+        hits = set()
+        for _, _, payloads in self.iter_matches(text):
+            hits.update(payloads)
+        return hits
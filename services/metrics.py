@@ -0,0 +1,227 @@
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# --- 監控設定 ---
+# 設為 0 可關閉每個請求一行的 [Timing] 結構化紀錄 (指標仍會持續累計)
+METRICS_TIMING_LOG = os.getenv("METRICS_TIMING_LOG", "1") == "1"
+
+# 延遲分桶 (秒)：涵蓋毫秒級的本地處理到數十秒的上游呼叫
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000)
+
+
+def _format_labels(labelnames, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """只增不減的計數器 (可帶標籤)"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """固定分桶的直方圖：observe 只做一次二分搜尋與加法，熱路徑的成本可忽略"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [各分桶計數..., 總和, 筆數]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus 文字格式 (text/plain; version=0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+request_seconds = registry.histogram(
+    "littletone_request_seconds", "Request latency by route and status.", ("route", "status"))
+stage_seconds = registry.histogram(
+    "littletone_stage_seconds", "Latency of each pipeline stage.", ("stage",))
+requests_total = registry.counter(
+    "littletone_requests_total", "Requests by route and HTTP status.", ("route", "status"))
+rate_limited_total = registry.counter(
+    "littletone_rate_limited_total", "Requests rejected by the rate limiter.", ("route",))
+response_cache_total = registry.counter(
+    "littletone_response_cache_total", "Response cache lookups by result.", ("result",))
+fallback_responses_total = registry.counter(
+    "littletone_fallback_responses_total", "Fallback (error) responses returned to users.", ("reason",))
+prompt_tokens_total = registry.counter(
+    "littletone_prompt_tokens_total", "Locally estimated prompt tokens sent upstream, by segment.", ("segment",))
+prompt_tokens = registry.histogram(
+    "littletone_prompt_tokens", "Locally estimated prompt tokens per upstream call.", buckets=TOKEN_BUCKETS)
+route_decisions_total = registry.counter(
+    "littletone_route_decisions_total", "Requests routed to each request class and model.", ("route", "model"))
+route_upstream_seconds = registry.histogram(
+    "littletone_route_upstream_seconds", "Upstream completion latency by request class.", ("route",))
+route_over_budget_total = registry.counter(
+    "littletone_route_over_budget_total", "Upstream calls that exceeded their class latency budget.", ("route",))
+screenshot_cache_total = registry.counter(
+    "littletone_screenshot_cache_total", "Screenshot compression cache lookups by result.", ("result",))
+screenshot_cache_saved_seconds_total = registry.counter(
+    "littletone_screenshot_cache_saved_seconds_total", "Compression time skipped by screenshot cache hits.")
+hedged_requests_total = registry.counter(
+    "littletone_hedged_requests_total", "Hedged upstream calls by request class and winning attempt.", ("route", "winner"))
+
+
+# --- 單一請求的計時紀錄 ---
+# 以 contextvars 傳遞，async view 交給共用事件迴圈執行時也能寫回同一份紀錄
+_current_timing = contextvars.ContextVar("littletone_request_timing", default=None)
+
+
+class RequestTiming:
+    """一個請求內各階段的耗時 (毫秒) 與附加資訊，請求結束時輸出成一行 JSON"""
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.info = {}
+
+    def record(self, stage, seconds):
+        # 同一階段出現多次 (例如串流的多段) 時累加
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds * 1000
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def begin_request(route):
+    timing = RequestTiming(route)
+    _current_timing.set(timing)
+    return timing
+
+
+@contextmanager
+def request_scope(timing):
+    """在其他執行緒 / generator 中延續同一個請求的計時紀錄"""
+    token = _current_timing.set(timing)
+    try:
+        yield timing
+    finally:
+        _current_timing.reset(token)
+
+
+def annotate(**info):
+    """在目前請求的紀錄附加資訊 (如 cache=hit)"""
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.info.update(info)
+
+
+def observe_stage(stage, seconds):
+    stage_seconds.observe(seconds, stage=stage)
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.record(stage, seconds)
+
+
+@contextmanager
+def stage(name):
+    """計時一個處理階段：寫入 littletone_stage_seconds，並記到目前請求的紀錄"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def finish_request(timing, status):
+    """請求結束：記錄總延遲與狀態碼，並輸出結構化的 [Timing] 紀錄"""
+    if timing is None:
+        return
+    elapsed = timing.elapsed()
+    requests_total.inc(route=timing.route, status=status)
+    request_seconds.observe(elapsed, route=timing.route, status=status)
+    if METRICS_TIMING_LOG:
+        record = {
+            "route": timing.route,
+            "status": status,
+            "total_ms": round(elapsed * 1000, 2),
+            "stages": {name: round(ms, 2) for name, ms in timing.stages.items()},
+            **timing.info,
+        }
+        print(f"[Timing] {json.dumps(record, ensure_ascii=False, separators=(',', ':'))}")
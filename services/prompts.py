@@ -1,3 +1,7 @@
+import hashlib
+
+from .tokens import estimate_tokens
+
 # 核心角色規範：定義 LittleTone 的人格特質與語言準則
 CORE_PERSONA = """
 你現在是 LittleTone，一位情商極高、精通「職場、朋友、親密關係、長輩」等全方位社交情商的台灣導師。
@@ -19,27 +23,8 @@ CORE_PERSONA = """
 3. 必須使用台灣慣用語（例如：訊息、品質、程度、稍微、不好意思、再麻煩了）。
 """
 
-def get_formatted_prompt(context_info=""):
-    """
-    根據是否有檢索到 RAG 在地化知識，動態生成最終的 System Prompt。
-    """
-    
-    # RAG 知識庫區塊處理
-    rag_section = ""
-    if context_info:
-        rag_section = f"""
-### 💡 在地化知識庫支援 (優先參考)：
-偵測到與目前情境相關的社交策略或術語，請優先參考以下內容進行回覆：
-{context_info}
---------------------------------------------------
-"""
-
-    # 注意：這裡使用了 f-string，內部的 JSON 結構必須使用雙重括號 {{ }}
-    full_prompt = f"""
-{CORE_PERSONA}
-
-{rag_section}
-
+# 固定指令區塊：診斷流程、輸出規範與 JSON 格式 (不含任何逐請求內容)
+STATIC_INSTRUCTIONS = """
 ### 🛠️ 第一階段：資訊診斷 (Slot Filling)
 你必須優先掃描目前的【對話紀錄 history】與【最新輸入】，檢查關係脈絡、衝突情境、社交目標是否齊全。
 
@@ -59,9 +44,9 @@ def get_formatted_prompt(context_info=""):
 
 #### **情況 A：資訊缺失 (status: diagnosing)**
 - `need_more_info`: 必須為 true。
-1. **若缺失【關係脈絡】**：`reply` 詢問身分（需問號），`options` 提供身分快捷鍵範例：{{"title": "是主管", "content": "對方是我的主管"}}。
+1. **若缺失【關係脈絡】**：`reply` 詢問身分（需問號），`options` 提供身分快捷鍵範例：{"title": "是主管", "content": "對方是我的主管"}。
 2. **若缺失【衝突情境】**：`reply` 詢問細節（需問號），**`options` 必須為空陣列 []**，引導使用者文字輸入。
-3. **若缺失【社交目標】**：`reply` 詢問意圖（需問號），`options` 提供目標快捷鍵範例：{{"title": "想和解", "content": "我希望能道歉並和解"}}。
+3. **若缺失【社交目標】**：`reply` 詢問意圖（需問號），`options` 提供目標快捷鍵範例：{"title": "想和解", "content": "我希望能道歉並和解"}。
 
 #### **情況 B：資訊充足 (status: ready)**
 - `need_more_info`: 必須為 false。
@@ -79,19 +64,116 @@ def get_formatted_prompt(context_info=""):
 請直接輸出以下 JSON 結構，確保程式能直接解析。注意：不要包含任何 Markdown 區塊標籤（如 ```json）。
 
 
-{{
+{
   "status": "diagnosing 或 ready",
   "need_more_info": true 或 false,
   "reply": "先給予暖心共情，再進行軟性導引。",
   "suggested_scenarios": [
-    {{
+    {
       "title": "按鈕標題",
       "example": "按鈕對應的文字內容" 
-    }}
+    }
   ],
   "key_change": "💡 核心洞察",
   "analysis": "分析內容",
   "tip": "社交小撇步"
-}}
+}
+"""
+
+# 精簡指令區塊：只做語氣改寫，不重新診斷 (搭配較小的模型，輸出短、回應快)
+COMPACT_INSTRUCTIONS = """
+### ✏️ 任務：語氣改寫
+使用者已在先前的對話中說明過情境，這一輪只需要依指令指定的語氣，直接產出一組能複製貼上的回覆範例。
+1. 從【對話紀錄 history】掌握對象、事件與目標，不要重新診斷，也不要再次詢問資訊。
+2. `reply` 只放改寫後的回覆範例本身（台灣 LINE 聊天體，1-3 句），不要加說明或引號。
+3. 其餘欄位保持精簡：`key_change` 一句話點出這個語氣的重點，`analysis` 與 `tip` 各一句。
+4. 偵測到「想死」、「自殺」等詞彙：`safety_alert` 設為 true，加入 1925、1995 專線。
+
+### 📋 輸出格式要求 (JSON)：
+請直接輸出以下 JSON 結構，不要包含任何 Markdown 區塊標籤（如 ```json）。
+
+{
+  "status": "ready",
+  "need_more_info": false,
+  "reply": "依指定語氣改寫的回覆範例",
+  "suggested_scenarios": [],
+  "key_change": "💡 這個語氣的重點",
+  "analysis": "一句話分析",
+  "tip": "社交小撇步"
+}
 """
-    return full_prompt
\ No newline at end of file
+
+# 語氣改寫指令 (與前端「切換語氣」按鈕送出的格式相同)
+TONE_INSTRUCTION_MARKER = "(指令："
+TONE_INSTRUCTION_TEMPLATE = "(指令：請針對目前的社交脈絡，直接以「{tone}」的語氣產出一組回覆範例。內容請放在 JSON 的 \"reply\" 欄位。)"
+
+# RAG 知識庫區塊的外框 (內容逐請求變動)
+RAG_SECTION_TEMPLATE = """
+### 💡 在地化知識庫支援 (優先參考)：
+偵測到與目前情境相關的社交策略或術語，請優先參考以下內容進行回覆：
+{context_info}
+--------------------------------------------------
+"""
+
+def _build_static_system_prompt(instructions=STATIC_INSTRUCTIONS):
+    return f"""
+{CORE_PERSONA}
+
+{instructions}"""
+
+# --- 匯入時只組裝一次 ---
+# 靜態 System Prompt 每次請求都逐位元組相同，放在 messages 最前面，
+# 才能形成穩定前綴、觸發上游的 Prompt Caching (降低 prefill 延遲與成本)
+STATIC_SYSTEM_PROMPT = _build_static_system_prompt()
+COMPACT_SYSTEM_PROMPT = _build_static_system_prompt(COMPACT_INSTRUCTIONS)
+# Prompt 變體：full 為完整診斷流程，compact 供語氣改寫等輕量請求使用 (見 services/request_router.py)
+PROMPT_VARIANTS = {
+    "full": STATIC_SYSTEM_PROMPT,
+    "compact": COMPACT_SYSTEM_PROMPT,
+}
+PROMPT_VERSION = hashlib.sha256(
+    ("".join(PROMPT_VARIANTS.values()) + RAG_SECTION_TEMPLATE).encode("utf-8")
+).hexdigest()[:16]
+STATIC_PROMPT_TOKENS = estimate_tokens(STATIC_SYSTEM_PROMPT)
+PROMPT_VARIANT_TOKENS = {name: estimate_tokens(prompt) for name, prompt in PROMPT_VARIANTS.items()}
+
+def format_rag_section(context_info=""):
+    """將 RAG 檢索結果包成知識庫區塊；沒有內容時回傳空字串"""
+    if not context_info:
+        return ""
+    return RAG_SECTION_TEMPLATE.format(context_info=context_info)
+
+def build_prompt_messages(context_info="", history=None, variant="full"):
+    """
+    依「靜態 System Prompt → 對話紀錄 → RAG 知識」的順序組出 messages 前段，
+    並回傳各區段的本地 Token 估算 (static / history / rag)。
+    對話紀錄放在 RAG 之前：同一段對話的下一輪請求，前綴仍與這一輪相同。
+    variant 指定靜態 System Prompt 的版本 (見 PROMPT_VARIANTS)。
+    """
+    messages = [{"role": "system", "content": PROMPT_VARIANTS[variant]}]
+    segment_tokens = {"static": PROMPT_VARIANT_TOKENS[variant], "history": 0, "rag": 0}
+
+    for message in history or []:
+        messages.append(message)
+        segment_tokens["history"] += estimate_tokens(_content_text(message))
+
+    rag_section = format_rag_section(context_info)
+    if rag_section:
+        messages.append({"role": "system", "content": rag_section})
+        segment_tokens["rag"] = estimate_tokens(rag_section)
+
+    return messages, segment_tokens
+
+def _content_text(message):
+    content = message.get("content", "") if isinstance(message, dict) else message
+    if isinstance(content, list):
+        # 多模態內容只估算文字部分
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content if isinstance(content, str) else str(content)
+
+def get_formatted_prompt(context_info=""):
+    """
+    根據是否有檢索到 RAG 在地化知識，動態生成最終的 System Prompt。
+    (單一字串版本：靜態內容在前、知識庫區塊接在最後，維持穩定前綴)
+    """
+    return STATIC_SYSTEM_PROMPT + format_rag_section(context_info)
@@ -1,5 +1,12 @@
+import hashlib
 import json
+import math
 import os
+import re
+import threading
+
+from .keyword_index import KeywordMatcher
+from .tokens import estimate_tokens
 
 # --- 1. 路徑設定 ---
 # 取得專案根目錄 (D:\LittleTone)
@@ -10,6 +17,31 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DICT_PATH = os.path.join(BASE_DIR, 'data', 'localization_dictionary.json')
 SCENARIO_PATH = os.path.join(BASE_DIR, 'data', 'emotion_scenarios.json')
 
+# --- 2. 檢索排序與預算設定 ---
+# 最多注入幾則知識、context_info 區塊的 Token 上限、以及最低分數門檻
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "5"))
+RAG_TOKEN_BUDGET = int(os.getenv("RAG_TOKEN_BUDGET", "900"))
+RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.8"))
+# 兩則知識的字元 bigram 相似度超過此值即視為重複
+RAG_DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.5"))
+SNIPPET_SEPARATOR = "\n\n---\n\n"
+
+# --- 3. 語意檢索設定 ---
+# exact：僅關鍵字比對；semantic：僅向量相似度；hybrid：兩者以 RRF 合併排序
+RAG_MODE = os.getenv("RAG_MODE", "hybrid")
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", os.path.join(BASE_DIR, 'data', 'index'))
+SEMANTIC_DIM = int(os.getenv("RAG_SEMANTIC_DIM", "2048"))
+SEMANTIC_CANDIDATES = int(os.getenv("RAG_SEMANTIC_CANDIDATES", "10"))
+SEMANTIC_MIN_SIMILARITY = float(os.getenv("RAG_SEMANTIC_MIN_SIMILARITY", "0.3"))
+# Reciprocal Rank Fusion 的平滑常數
+RRF_K = 60
+# hybrid 模式下「只有語意命中、沒有任何關鍵字命中」的片段另需通過的門檻：
+# 相似度下限，以及查詢本身至少要有幾個字 (過短的查詢只採用關鍵字命中)，
+# 避免「ok」、「hello」這類寒暄把預算花在雜訊上
+RAG_SEMANTIC_ONLY_MIN_SIMILARITY = float(os.getenv("RAG_SEMANTIC_ONLY_MIN_SIMILARITY", "0.5"))
+RAG_SEMANTIC_MIN_QUERY_CHARS = int(os.getenv("RAG_SEMANTIC_MIN_QUERY_CHARS", "4"))
+_QUERY_NORMALIZE_PATTERN = re.compile(r"[\W_]+")
+
 def load_json_data(file_path):
     """通用的 JSON 載入工具，含編碼處理"""
     try:
@@ -22,65 +54,321 @@ def load_json_data(file_path):
         print(f"[RAG Service] 讀取 {file_path} 失敗: {e}")
     return []
 
-def retrieve_social_knowledge(user_query):
+def _render_term(item):
+    """將在地詞彙預先組成 Prompt 片段"""
+    term = item.get("term", "")
+    advice = item.get('tone_advice', '無')
+    # 取得建議用法
+    suggestion = item.get('suggestions', [item.get('local_context', '無')])[0]
+    return (
+        f"【台灣在地術語：{term}】\n"
+        f"- 定義：{item.get('definition')}\n"
+        f"- 語氣建議：{advice}\n"
+        f"- 推薦用法：{suggestion}"
+    )
+
+def _render_scenario(scene):
+    """將情緒場景預先組成 Prompt 片段 (對應你的 JSON 格式)"""
+    context = scene.get("contextual_analysis", {})
+    category = scene.get('category', '未分類')
+    clue = context.get('cultural_clue', '無')
+    emotion = context.get('correct_emotion', '待判讀')
+    risk = context.get('risk_level', '未知')
+    action = scene.get('ai_action_guideline', '依一般程序處理')
+    note = scene.get('localization_note', '無')
+    return (
+        f"【情緒場景分析：{category}】\n"
+        f"- 文化脈絡：{clue}\n"
+        f"- 真實情緒判讀：{emotion} (社交風險：{risk})\n"
+        f"- AI 應對方針：{action}\n"
+        f"- 台灣文化備註：{note}"
+    )
+
+class SocialKnowledgeBase:
+    """
+    啟動時載入一次的知識庫：預先渲染所有片段，
+    並把「詞彙 + 場景關鍵字」編進同一個 Aho-Corasick 比對器。
+    """
+
+    TERM = "term"
+    SCENARIO = "scenario"
+
+    def __init__(self, dict_data, scenario_data):
+        self.terms = [item for item in dict_data if item.get("term")]
+        self.scenarios = list(scenario_data)
+        self.term_snippets = [_render_term(item) for item in self.terms]
+        self.scenario_snippets = [_render_scenario(scene) for scene in self.scenarios]
+        # 知識庫內容版本：資料異動時，下游快取的 Key 也會跟著改變
+        digest = hashlib.sha1()
+        for text in self.term_snippets + self.scenario_snippets:
+            digest.update(text.encode("utf-8"))
+        self.version = digest.hexdigest()
+        self.term_tokens = [estimate_tokens(text) for text in self.term_snippets]
+        self.scenario_tokens = [estimate_tokens(text) for text in self.scenario_snippets]
+
+        self.matcher = KeywordMatcher()
+        for index, item in enumerate(self.terms):
+            self.matcher.add(item["term"], (self.TERM, index))
+        for index, scene in enumerate(self.scenarios):
+            for kw in scene.get("contextual_analysis", {}).get("keywords", []):
+                self.matcher.add(kw, (self.SCENARIO, index))
+        self.matcher.build()
+
+        # 預先計算每個關鍵字的特異度 (IDF × 長度權重)：
+        # 「耶」、「啦」這類常見單字會命中大量場景，權重自然被壓低
+        total_docs = len(self.terms) + len(self.scenarios)
+        self.keyword_weights = {}
+        for pattern, payloads in self.matcher.items():
+            doc_freq = len(set(payloads))
+            idf = math.log(1 + total_docs / doc_freq)
+            self.keyword_weights[pattern] = idf * (min(len(pattern), 4) / 4) ** 2
+        self._bigram_cache = {}
+        self._semantic_index = None
+        self._semantic_lock = threading.Lock()
+        self.scenario_keyword_counts = [
+            len(set(scene.get("contextual_analysis", {}).get("keywords", [])))
+            for scene in self.scenarios
+        ]
+
+    def bigrams(self, kind, index):
+        """片段的字元 bigram 集合 (供去重比對，首次使用時才計算並快取)"""
+        key = (kind, index)
+        cached = self._bigram_cache.get(key)
+        if cached is None:
+            snippet = self.term_snippets[index] if kind == self.TERM else self.scenario_snippets[index]
+            cached = self._bigram_cache[key] = _bigrams(snippet)
+        return cached
+
+    @classmethod
+    def from_files(cls, dict_path=DICT_PATH, scenario_path=SCENARIO_PATH):
+        return cls(load_json_data(dict_path), load_json_data(scenario_path))
+
+    def match(self, user_query):
+        """單次線性掃描，回傳 (命中詞彙索引, 命中場景索引)，皆依資料原始順序排列"""
+        hits = self.matcher.find_payloads(user_query)
+        term_ids = sorted(index for kind, index in hits if kind == self.TERM)
+        scenario_ids = sorted(index for kind, index in hits if kind == self.SCENARIO)
+        return term_ids, scenario_ids
+
+    def _candidate(self, kind, index, score, matched):
+        is_term = kind == self.TERM
+        return {
+            "kind": kind,
+            "index": index,
+            "score": score,
+            "matched": matched,
+            "snippet": self.term_snippets[index] if is_term else self.scenario_snippets[index],
+            "tokens": self.term_tokens[index] if is_term else self.scenario_tokens[index],
+        }
+
+    def semantic_texts(self):
+        """向量索引的文件內容：詞彙取 term + definition，場景取 input_text + keywords"""
+        texts = [f"{item.get('term', '')} {item.get('definition', '')}" for item in self.terms]
+        for scene in self.scenarios:
+            keywords = scene.get("contextual_analysis", {}).get("keywords", [])
+            texts.append(f"{scene.get('input_text', '')} {' '.join(keywords)}")
+        return texts
+
+    def semantic_index(self):
+        """首次使用時才載入 (或重建) 向量索引"""
+        if self._semantic_index is None:
+            with self._semantic_lock:
+                if self._semantic_index is None:
+                    # numpy 只在語意檢索第一次被用到時才載入
+                    from .semantic_index import SemanticIndex
+
+                    self._semantic_index = SemanticIndex.load_or_build(
+                        self.semantic_texts(), RAG_INDEX_DIR, dim=SEMANTIC_DIM
+                    )
+        return self._semantic_index
+
+    def semantic_rank_batch(self, user_queries, top_k=SEMANTIC_CANDIDATES,
+                            min_similarity=SEMANTIC_MIN_SIMILARITY):
+        """批次語意檢索：回傳每個查詢的候選清單，score 為 cosine 相似度"""
+        term_count = len(self.terms)
+        results = []
+        for hits in self.semantic_index().search_batch(user_queries, top_k):
+            candidates = []
+            for doc_id, similarity in hits:
+                if similarity < min_similarity:
+                    continue
+                if doc_id < term_count:
+                    kind, index = self.TERM, doc_id
+                else:
+                    kind, index = self.SCENARIO, doc_id - term_count
+                candidates.append(self._candidate(kind, index, round(similarity, 4), []))
+            results.append(candidates)
+        return results
+
+    def semantic_rank(self, user_query, top_k=SEMANTIC_CANDIDATES,
+                      min_similarity=SEMANTIC_MIN_SIMILARITY):
+        return self.semantic_rank_batch([user_query], top_k, min_similarity)[0]
+
+    def rank(self, user_query):
+        """
+        依命中關鍵字計分並由高到低排序。
+        分數 = Σ 關鍵字特異度 × (1 + log 命中次數)，再乘上場景關鍵字覆蓋率加權。
+        """
+        hit_counts = {}
+        for _, pattern, payloads in self.matcher.iter_matches(user_query):
+            for payload in set(payloads):
+                per_item = hit_counts.setdefault(payload, {})
+                per_item[pattern] = per_item.get(pattern, 0) + 1
+
+        candidates = []
+        for (kind, index), patterns in hit_counts.items():
+            score = sum(
+                self.keyword_weights[pattern] * (1 + math.log(count))
+                for pattern, count in patterns.items()
+            )
+            if kind == self.SCENARIO:
+                coverage = len(patterns) / max(self.scenario_keyword_counts[index], 1)
+                score *= 0.5 + 0.5 * coverage
+            candidates.append(self._candidate(
+                kind, index, round(score, 4), sorted(patterns, key=len, reverse=True)
+            ))
+
+        # 同分時維持原本的資料順序：詞彙優先，其次依檔案順序
+        candidates.sort(key=lambda c: (-c["score"], c["kind"] != self.TERM, c["index"]))
+        return candidates
+
+def _bigrams(text):
+    return frozenset(text[i:i + 2] for i in range(len(text) - 1))
+
+def _is_near_duplicate(bigrams, selected_bigrams, threshold):
+    for other in selected_bigrams:
+        shared = len(bigrams & other)
+        union = len(bigrams) + len(other) - shared
+        if union and shared / union >= threshold:
+            return True
+    return False
+
+_knowledge_base = None
+_knowledge_base_lock = threading.Lock()
+
+def get_knowledge_base():
+    """取得 (必要時建立) 全域共用的知識庫索引"""
+    global _knowledge_base
+    if _knowledge_base is None:
+        with _knowledge_base_lock:
+            if _knowledge_base is None:
+                _knowledge_base = SocialKnowledgeBase.from_files()
+                print(f"[RAG Service] 知識庫索引完成：{len(_knowledge_base.terms)} 個詞彙、"
+                      f"{len(_knowledge_base.scenarios)} 個場景")
+    return _knowledge_base
+
+def knowledge_version():
+    """知識庫內容 + 檢索參數的版本字串 (相同版本下，同一查詢必定得到相同的 context_info)"""
+    settings = (
+        f"{RAG_MODE}:{RAG_TOP_K}:{RAG_TOKEN_BUDGET}:{RAG_MIN_SCORE}:{RAG_DEDUP_THRESHOLD}:"
+        f"{RAG_SEMANTIC_ONLY_MIN_SIMILARITY}:{RAG_SEMANTIC_MIN_QUERY_CHARS}"
+    )
+    return f"{get_knowledge_base().version}:{settings}"
+
+def _fuse_rankings(exact, semantic):
+    """以 Reciprocal Rank Fusion 合併兩份排序，保留各自的原始分數供調整參考"""
+    fused = {}
+    for source, candidates in (("exact_score", exact), ("similarity", semantic)):
+        for rank, candidate in enumerate(candidates):
+            key = (candidate["kind"], candidate["index"])
+            merged = fused.get(key)
+            if merged is None:
+                merged = fused[key] = dict(candidate, score=0.0, exact_score=None, similarity=None)
+            merged["score"] += 1 / (RRF_K + rank + 1)
+            merged[source] = candidate["score"]
+            if candidate["matched"]:
+                merged["matched"] = candidate["matched"]
+
+    results = list(fused.values())
+    for candidate in results:
+        candidate["score"] = round(candidate["score"], 6)
+    results.sort(key=lambda c: -c["score"])
+    return results
+
+def rank_social_knowledge(user_query, mode=None, min_score=None):
+    """
+    依檢索模式產生排序後的候選片段：
+    - exact：Aho-Corasick 關鍵字比對分數
+    - semantic：字元 n-gram 向量的 cosine 相似度
+    - hybrid：兩者以 RRF 合併 (預設)
+    """
+    mode = RAG_MODE if mode is None else mode
+    min_score = RAG_MIN_SCORE if min_score is None else min_score
+    kb = get_knowledge_base()
+
+    exact = []
+    if mode != "semantic":
+        exact = [c for c in kb.rank(user_query) if c["score"] >= min_score]
+        if mode == "exact":
+            return exact
+
+    semantic = kb.semantic_rank(user_query)
+    if mode == "semantic":
+        return semantic
+    # RRF 之後分數只反映名次，RAG_MIN_SCORE 管不到純語意候選，需另外把關
+    return [
+        candidate for candidate in _fuse_rankings(exact, semantic)
+        if candidate["exact_score"] is not None or _semantic_only_relevant(candidate, user_query)
+    ]
+
+def _semantic_only_relevant(candidate, user_query):
+    """純語意候選的相關度門檻：相似度夠高，且查詢不是過短的寒暄"""
+    if candidate["similarity"] < RAG_SEMANTIC_ONLY_MIN_SIMILARITY:
+        return False
+    return len(_QUERY_NORMALIZE_PATTERN.sub("", user_query)) >= RAG_SEMANTIC_MIN_QUERY_CHARS
+
+def select_social_knowledge(user_query, top_k=None, token_budget=None, mode=None, min_score=None):
     """
-    核心檢索邏輯：同時搜尋在地詞彙與情緒場景。
+    排序後挑選要注入 Prompt 的知識片段：去除近似重複、取前 top_k 則，
+    並確保總長度不超過 token_budget。回傳含分數的片段清單，方便調整參數。
     """
     # ✨ 新增防呆：如果是系統自動生成的指令 (如：轉化語氣要求)，則跳過檢索以節省效能
     if not user_query or "(指令：" in user_query:
-        return ""
+        return []
 
-    # 載入資料
-    dict_data = load_json_data(DICT_PATH)
-    scenario_data = load_json_data(SCENARIO_PATH)
-    
-    knowledge_pieces = []
-
-    # --- 第一部分：在地詞彙比對 ---
-    for item in dict_data:
-        term = item.get("term", "")
-        if term and term in user_query:
-            advice = item.get('tone_advice', '無')
-            # 取得建議用法
-            suggestion = item.get('suggestions', [item.get('local_context', '無')])[0]
-            knowledge_pieces.append(
-                f"【台灣在地術語：{term}】\n"
-                f"- 定義：{item.get('definition')}\n"
-                f"- 語氣建議：{advice}\n"
-                f"- 推薦用法：{suggestion}"
-            )
+    top_k = RAG_TOP_K if top_k is None else top_k
+    token_budget = RAG_TOKEN_BUDGET if token_budget is None else token_budget
 
-    # --- 第二部分：情緒場景比對 (對應你的 JSON 格式) ---
-    for scene in scenario_data:
-        context = scene.get("contextual_analysis", {})
-        keywords = context.get("keywords", [])
-        
-        # 只要使用者輸入中命中關鍵字 (如：11 點、老地方、為了你好)
-        if any(kw in user_query for kw in keywords):
-            # 依照你提供的 JSON 結構精準抓取欄位
-            category = scene.get('category', '未分類')
-            clue = context.get('cultural_clue', '無')
-            emotion = context.get('correct_emotion', '待判讀')
-            risk = context.get('risk_level', '未知')
-            action = scene.get('ai_action_guideline', '依一般程序處理')
-            note = scene.get('localization_note', '無')
-
-            knowledge_pieces.append(
-                f"【情緒場景分析：{category}】\n"
-                f"- 文化脈絡：{clue}\n"
-                f"- 真實情緒判讀：{emotion} (社交風險：{risk})\n"
-                f"- AI 應對方針：{action}\n"
-                f"- 台灣文化備註：{note}"
-            )
+    separator_tokens = estimate_tokens(SNIPPET_SEPARATOR)
+    selected = []
+    selected_bigrams = []
+    used_tokens = 0
 
-    # 2. 彙整結果
-    if not knowledge_pieces:
-        return ""
+    kb = get_knowledge_base()
+    for candidate in rank_social_knowledge(user_query, mode=mode, min_score=min_score):
+        if len(selected) >= top_k:
+            break
+
+        # 超出預算的片段直接略過，讓後面較短的片段仍有機會補上
+        cost = candidate["tokens"] + (separator_tokens if selected else 0)
+        if used_tokens + cost > token_budget:
+            continue
+
+        bigrams = kb.bigrams(candidate["kind"], candidate["index"])
+        if _is_near_duplicate(bigrams, selected_bigrams, RAG_DEDUP_THRESHOLD):
+            continue
 
+        selected.append(candidate)
+        selected_bigrams.append(bigrams)
+        used_tokens += cost
+
+    return selected
+
+def assemble_context(pieces):
+    """將挑選後的片段組成 context_info 文字區塊"""
     # 使用清晰的分隔線，幫助 GPT 區分不同的知識點
-    return "\n\n---\n\n".join(knowledge_pieces)
+    return SNIPPET_SEPARATOR.join(piece["snippet"] for piece in pieces)
+
+def retrieve_social_knowledge(user_query, top_k=None, token_budget=None, mode=None):
+    """
+    核心檢索邏輯：同時搜尋在地詞彙與情緒場景，依相關度排序並控管長度。
+    """
+    pieces = select_social_knowledge(user_query, top_k=top_k, token_budget=token_budget, mode=mode)
+    if not pieces:
+        return ""
+    return assemble_context(pieces)
 
-# 測試區塊
+# 測試區塊 (請以 python -m services.rag_service 執行)
 if __name__ == "__main__":
     print("=== LittleTone RAG 檢索測試 ===")
     # 測試命中你提供的 scenario_240
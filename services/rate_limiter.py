@@ -0,0 +1,177 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# --- 限流設定 (皆可由環境變數調整) ---
+# 每條規則是一個 Token Bucket：capacity 為可累積的額度，refill_seconds 為每補 1 點所需秒數
+# 各路由使用各自的規則，另外每次扣款也同時扣同一個 IP 的共用額度 (SHARED_RULE)
+RATE_LIMIT_RULES = {
+    # /api/chat：平均每 5 秒 1 次，可短暫連發 2 次
+    "chat": {
+        "capacity": float(os.getenv("RATE_LIMIT_CHAT_CAPACITY", "2")),
+        "refill_seconds": float(os.getenv("RATE_LIMIT_CHAT_REFILL_SECONDS", "5")),
+    },
+    # /api/chat/stream：與 /api/chat 相同的預設值，可分開調整
+    "stream": {
+        "capacity": float(os.getenv("RATE_LIMIT_STREAM_CAPACITY", "2")),
+        "refill_seconds": float(os.getenv("RATE_LIMIT_STREAM_REFILL_SECONDS", "5")),
+    },
+    # /api/chat/batch：容量需容納一次完整批次 (最多 5 則、含圖片時每則 2 點)，補充速度與 chat 相同
+    "batch": {
+        "capacity": float(os.getenv("RATE_LIMIT_BATCH_CAPACITY", "10")),
+        "refill_seconds": float(os.getenv("RATE_LIMIT_BATCH_REFILL_SECONDS", "5")),
+    },
+    # 共用額度：所有路由加總的上游呼叫上限，輪流打不同路由也無法突破 (容量需容納一次完整批次)
+    "upstream": {
+        "capacity": float(os.getenv("RATE_LIMIT_UPSTREAM_CAPACITY", "10")),
+        "refill_seconds": float(os.getenv("RATE_LIMIT_UPSTREAM_REFILL_SECONDS", "5")),
+    },
+}
+SHARED_RULE = "upstream"
+# 每次請求消耗的額度：帶圖片的請求成本較高
+TEXT_COST = float(os.getenv("RATE_LIMIT_TEXT_COST", "1"))
+IMAGE_COST = float(os.getenv("RATE_LIMIT_IMAGE_COST", "2"))
+
+# memory：單一行程內有效；sqlite：多個 worker / 行程共用同一份限流狀態
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "/tmp/littletone_rate_limit.db")
+# 記憶體模式最多追蹤的 Key 數量，超過時淘汰最久未出現的 IP，確保記憶體不會無限成長
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+class MemoryBucketStore:
+    """
+    行程內的 Token Bucket 儲存：OrderedDict 依最後使用時間排序，
+    每次檢查都是 O(1)，並順手清掉已回滿 (等同不存在) 的閒置 Key。
+    """
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated, idle_ttl)
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate, cost, now):
+        with self._lock:
+            self._sweep(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = capacity
+            else:
+                tokens = _refill(bucket[0], bucket[1], now, capacity, rate)
+                self._buckets.move_to_end(key)
+
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now, capacity / rate)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _sweep(self, now, limit=8):
+        # 最前面的是最久沒出現的 Key；閒置超過「回滿所需時間」即可安全刪除
+        for _ in range(limit):
+            if not self._buckets:
+                return
+            key, (_, updated, idle_ttl) = next(iter(self._buckets.items()))
+            if now - updated < idle_ttl:
+                return
+            del self._buckets[key]
+
+
+class SQLiteBucketStore:
+    """
+    以 SQLite (WAL 模式) 保存 Token Bucket，讓 gunicorn 多個 worker 共用限流狀態。
+    每次檢查在一個 IMMEDIATE 交易內完成「讀取 → 補充 → 扣除 → 寫回」，確保多行程下的原子性。
+    """
+
+    SWEEP_EVERY = 1000
+
+    def __init__(self, db_path=RATE_LIMIT_DB):
+        self._db = sqlite3.connect(db_path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_rate_buckets_expires ON rate_buckets (expires_at)")
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def consume(self, key, capacity, rate, cost, now):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens = capacity if row is None else _refill(row[0], row[1], now, capacity, rate)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                self._db.execute(
+                    "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, tokens, now, now + (capacity - tokens) / rate),
+                )
+
+                # 定期清掉已回滿的 Key，讓資料表大小維持在「近期活躍 IP」的數量
+                self._calls += 1
+                if self._calls % self.SWEEP_EVERY == 0:
+                    self._db.execute("DELETE FROM rate_buckets WHERE expires_at <= ?", (now,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+
+class RateLimiter:
+    """依規則 (route) 分開計算額度的 Token Bucket 限流器，並同時扣除同一個 Key 的共用額度"""
+
+    def __init__(self, store, rules=None):
+        self.store = store
+        self.rules = rules or RATE_LIMIT_RULES
+
+    def check(self, key, rule="chat", cost=TEXT_COST):
+        """
+        扣除 key 在指定規則下的額度，通過後再扣共用額度 (SHARED_RULE)。
+        回傳 (是否允許, 需等待秒數)。
+        共用額度不足時已扣的路由額度不退回：此時該 IP 本來就超過總量上限。
+        """
+        allowed, wait_seconds = self._consume(key, rule, cost)
+        if not allowed or rule == SHARED_RULE or SHARED_RULE not in self.rules:
+            return allowed, wait_seconds
+        return self._consume(key, SHARED_RULE, cost)
+
+    def _consume(self, key, rule, cost):
+        config = self.rules[rule]
+        capacity = config["capacity"]
+        rate = 1 / config["refill_seconds"]
+        # 成本不可超過容量，否則永遠無法通過
+        cost = min(cost, capacity)
+        return self.store.consume(f"{rule}:{key}", capacity, rate, cost, time.time())
+
+
+def create_rate_limiter(backend=RATE_LIMIT_BACKEND):
+    if backend == "sqlite":
+        try:
+            return RateLimiter(SQLiteBucketStore())
+        except sqlite3.Error as e:
+            print(f"[RateLimiter] SQLite 後端啟用失敗，改用記憶體: {e}")
+    return RateLimiter(MemoryBucketStore())
+
+
+# 全域共用的限流器
+rate_limiter = create_rate_limiter()
@@ -0,0 +1,114 @@
+import json
+import os
+
+from .prompts import PROMPT_VARIANTS, TONE_INSTRUCTION_MARKER
+
+# --- 請求分類路由設定 ---
+# 助理回覆中快捷按鈕所在的欄位，以及每個按鈕可能送出的文字欄位
+CHIP_LIST_KEYS = ("suggested_scenarios", "options")
+CHIP_TEXT_KEYS = ("title", "example", "content")
+
+
+def _route_config(name, model, prompt, max_tokens, latency_budget, pool, temperature=0.4):
+    """
+    單一請求類別的設定，皆可用環境變數覆寫 (ROUTE_<類別>_MODEL / _PROMPT / _MAX_TOKENS / _LATENCY_BUDGET)。
+    pool 決定佔用哪一組上游名額：text 類別有獨立上限，保留部分名額給截圖分析 (vision)。
+    max_tokens 為 0 時不設輸出上限 (交給模型預設值)。
+    """
+    prefix = f"ROUTE_{name.upper()}_"
+    prompt = os.getenv(prefix + "PROMPT", prompt)
+    if prompt not in PROMPT_VARIANTS:
+        print(f"[Router] {prefix}PROMPT={prompt} 不存在，改用 full")
+        prompt = "full"
+    return {
+        "name": name,
+        "model": os.getenv(prefix + "MODEL", model),
+        "prompt": prompt,
+        "max_tokens": int(os.getenv(prefix + "MAX_TOKENS", str(max_tokens))),
+        "latency_budget": float(os.getenv(prefix + "LATENCY_BUDGET", str(latency_budget))),
+        "pool": pool,
+        "temperature": temperature,  # 取中間值，兼顧穩定與創意
+    }
+
+
+# 截圖分析與文字診斷走完整流程；語氣改寫與快捷回覆改用小模型
+# 完整 Prompt 要求的 JSON 欄位多 (analysis、多組 suggested_scenarios)，設上限容易被截斷，因此不設上限；
+# 只有搭配精簡 Prompt 的語氣改寫才限制輸出長度
+# 延遲預算 (秒) 即請求期限：超過時改回傳只依知識庫組出的在地備援回覆
+ROUTES = {
+    "screenshot": _route_config("screenshot", "gpt-4o", "full", 0, 30, "vision"),
+    "text_diagnosis": _route_config("text_diagnosis", "gpt-4o", "full", 0, 20, "text"),
+    "quick_reply": _route_config("quick_reply", "gpt-4o-mini", "full", 0, 10, "text"),
+    "tone_rewrite": _route_config("tone_rewrite", "gpt-4o-mini", "compact", 400, 8, "text"),
+}
+
+
+def is_tone_instruction(text):
+    """前端「切換語氣」按鈕送出的語氣改寫指令"""
+    return bool(text) and TONE_INSTRUCTION_MARKER in text
+
+
+def _normalize_chip(text):
+    return "".join(text.split())
+
+
+def _chip_texts(message):
+    """
+    助理回合提供的快捷按鈕文字 (標題與內容)。
+    按鈕可放在訊息本身的 suggested_scenarios / options 欄位 (Session 保存的格式)，
+    或在 content 為完整 JSON 回覆時取其中的欄位。
+    """
+    sources = [message]
+    content = message.get("content")
+    if isinstance(content, str) and content.lstrip().startswith("{"):
+        try:
+            parsed = json.loads(content)
+        except ValueError:
+            parsed = None
+        if isinstance(parsed, dict):
+            sources.append(parsed)
+
+    texts = set()
+    for source in sources:
+        for key in CHIP_LIST_KEYS:
+            chips = source.get(key)
+            if not isinstance(chips, list):
+                continue
+            for chip in chips:
+                if isinstance(chip, str):
+                    texts.add(_normalize_chip(chip))
+                elif isinstance(chip, dict):
+                    texts.update(_normalize_chip(chip[field]) for field in CHIP_TEXT_KEYS
+                                 if isinstance(chip.get(field), str))
+    texts.discard("")
+    return texts
+
+
+def is_quick_reply(user_text, history):
+    """使用者點了上一則助理回覆的快捷按鈕：輸入與其中一個按鈕的文字相同 (忽略空白)"""
+    if not user_text or not isinstance(history, list):
+        return False
+    for message in reversed(history):
+        if isinstance(message, dict) and message.get("role") == "assistant":
+            return _normalize_chip(user_text) in _chip_texts(message)
+    return False
+
+
+def classify_request(user_text, has_image=False, history=None):
+    """
+    依請求內容判斷類別 (只看輸入本身，不需呼叫上游)：
+    有截圖 → screenshot；語氣改寫指令 → tone_rewrite；
+    點選上一則回覆的快捷按鈕 → quick_reply；其餘 → text_diagnosis
+    """
+    if has_image:
+        return "screenshot"
+    if is_tone_instruction(user_text):
+        return "tone_rewrite"
+    if is_quick_reply(user_text, history):
+        return "quick_reply"
+    return "text_diagnosis"
+
+
+def route_request(user_text, has_image=False, history=None):
+    """回傳請求類別對應的路由設定 (dict，呼叫端請勿修改)"""
+    return ROUTES[classify_request(user_text, has_image, history)]
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# --- 快取設定 (皆可由環境變數調整) ---
+CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# 設定檔案路徑即啟用 SQLite 磁碟層 (重新啟動後仍保留)；留空則只用記憶體
+CACHE_DB_PATH = os.getenv("RESPONSE_CACHE_DB", "")
+# SQLite 層最多保留的筆數；定期清理時先刪除過期項目，仍超過時再刪最早到期的
+CACHE_DB_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_DB_MAX_ENTRIES", "100000"))
+
+
+def _normalize_text(text):
+    # 去除頭尾空白並合併連續空白，避免「多一個空格」就無法命中快取
+    return " ".join(str(text or "").split())
+
+
+def _normalize_message(message):
+    if not isinstance(message, dict):
+        return _normalize_text(message)
+    content = message.get("content")
+    if isinstance(content, str):
+        content = _normalize_text(content)
+    return {"role": message.get("role"), "content": content}
+
+
+def digest_bytes(data):
+    """圖片等二進位內容的摘要"""
+    if data is None:
+        return ""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def request_fingerprint(prompt_version, history, user_text, image_digest, model, temperature):
+    """
+    產生請求指紋：(System Prompt 版本, 截斷後歷史, 使用者文字, 圖片摘要, 模型, 溫度)
+    經正規化後的 SHA-256。內容相同的請求一定得到相同的指紋。
+    """
+    payload = {
+        "prompt": prompt_version,
+        "history": [_normalize_message(m) for m in (history or [])],
+        "text": _normalize_text(user_text),
+        "image": image_digest or "",
+        "model": model,
+        "temperature": temperature,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    兩層式回應快取：
+    1. 記憶體 LRU：同時以筆數與總位元組數限制，並帶有 TTL
+    2. (選用) SQLite 磁碟層：記憶體未命中時查詢，命中後回填記憶體
+    快取值以 JSON 字串保存，每次命中都回傳新的 dict，呼叫端可放心修改。
+    """
+
+    # SQLite 層每寫入幾筆清理一次 (過期項目 + 筆數上限)
+    SWEEP_EVERY = 1000
+
+    def __init__(self, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES,
+                 max_bytes=CACHE_MAX_BYTES, db_path=CACHE_DB_PATH, db_max_entries=CACHE_DB_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_max_entries = db_max_entries
+        self._db_writes = 0
+        self._entries = OrderedDict()  # key -> (expires_at, json_str)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS response_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                self._db.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache (expires_at)"
+                )
+                # 啟動時先清一次，上次執行留下的過期項目不會一直佔用空間
+                self._db_sweep(time.time())
+            except sqlite3.Error as e:
+                print(f"[ResponseCache] SQLite 快取層啟用失敗，改用純記憶體: {e}")
+                self._db = None
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    self._stats["memory_hits"] += 1
+                    return json.loads(value)
+                self._remove(key)
+                self._stats["expirations"] += 1
+
+            value = self._db_get(key, now)
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+
+            self._stats["hits"] += 1
+            self._stats["disk_hits"] += 1
+            self._store_memory(key, value[0], value[1])
+            return json.loads(value[1])
+
+    def set(self, key, result):
+        value = json.dumps(result, ensure_ascii=False)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store_memory(key, expires_at, value)
+            self._stats["stores"] += 1
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, value, expires_at),
+                    )
+                    self._db_writes += 1
+                    if self._db_writes % self.SWEEP_EVERY == 0:
+                        self._db_sweep(time.time())
+                except sqlite3.Error as e:
+                    print(f"[ResponseCache] 寫入 SQLite 失敗: {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM response_cache")
+
+    # --- 內部工具 (呼叫前須持有 self._lock) ---
+    def _store_memory(self, key, expires_at, value):
+        if key in self._entries:
+            self._remove(key)
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (expires_at, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def _db_get(self, key, now):
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT expires_at, value FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[0] <= now:
+                self._db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._stats["expirations"] += 1
+                return None
+            return row
+        except sqlite3.Error as e:
+            print(f"[ResponseCache] 讀取 SQLite 失敗: {e}")
+            return None
+
+    def _db_sweep(self, now):
+        # 刪除過期項目；仍超過筆數上限時，刪掉最早到期 (即最早寫入) 的項目
+        expired = self._db.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,)).rowcount
+        self._stats["expirations"] += max(0, expired)
+        excess = self._db.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] - self.db_max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM response_cache WHERE key IN "
+                "(SELECT key FROM response_cache ORDER BY expires_at LIMIT ?)",
+                (excess,),
+            )
+            self._stats["evictions"] += excess
+
+
+# 全域共用的回應快取
+response_cache = ResponseCache()
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+# 只保留文字與數字，標點與空白不參與 n-gram
+_NORMALIZE_PATTERN = re.compile(r"[\W_]+")
+
+
+class HashedNgramVectorizer:
+    """
+    離線向量化工具：字元 n-gram + Hashing Trick，不需要詞表也不需要網路。
+    使用 crc32 作為雜湊函式，確保不同行程 / 重新啟動後特徵位置一致。
+    """
+
+    def __init__(self, dim=2048, ngram_range=(1, 2)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def _features(self, text):
+        text = _NORMALIZE_PATTERN.sub("", (text or "").lower())
+        counts = {}
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                slot = zlib.crc32(text[i:i + n].encode("utf-8")) % self.dim
+                counts[slot] = counts.get(slot, 0) + 1
+        return counts
+
+    def transform(self, texts, idf=None):
+        """轉成 (len(texts), dim) 的 float32 矩陣：次線性 TF × IDF，並做 L2 正規化"""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for slot, count in self._features(text).items():
+                matrix[row, slot] = 1.0 + np.log(count)
+        if idf is not None:
+            matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        return matrix
+
+    def fit_idf(self, texts):
+        doc_freq = np.zeros(self.dim, dtype=np.float32)
+        for text in texts:
+            doc_freq[list(self._features(text))] += 1
+        return (np.log((1 + len(texts)) / (1 + doc_freq)) + 1).astype(np.float32)
+
+
+def _is_writable_dir(directory):
+    """directory (或尚未建立時最近的上層目錄) 可寫入；唯讀檔案系統 (如 Vercel) 回傳 False"""
+    directory = os.path.abspath(directory)
+    while not os.path.isdir(directory):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return False
+        directory = parent
+    return os.access(directory, os.W_OK)
+
+
+def _write_atomic(path, write):
+    """以 write(檔案物件) 寫入暫存檔後再改名，避免讀取端看到寫一半的檔案"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class SemanticIndex:
+    """
+    預先計算的向量索引：每列為一份文件的正規化向量，存成 .npy 並以 mmap 載入。
+    查詢時以矩陣乘法一次算出整批查詢的 cosine 相似度，再取 top-k。
+    """
+
+    MATRIX_FILE = "semantic_matrix.npy"
+    IDF_FILE = "semantic_idf.npy"
+    META_FILE = "semantic_meta.json"
+
+    def __init__(self, matrix, idf, vectorizer, fingerprint):
+        self.matrix = matrix
+        self.idf = idf
+        self.vectorizer = vectorizer
+        self.fingerprint = fingerprint
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @staticmethod
+    def fingerprint_of(texts, dim, ngram_range):
+        digest = hashlib.sha1(f"{dim}:{ngram_range}".encode("utf-8"))
+        for text in texts:
+            digest.update(text.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    @classmethod
+    def build(cls, texts, dim=2048, ngram_range=(1, 2)):
+        vectorizer = HashedNgramVectorizer(dim, ngram_range)
+        idf = vectorizer.fit_idf(texts)
+        matrix = vectorizer.transform(texts, idf)
+        return cls(matrix, idf, vectorizer, cls.fingerprint_of(texts, dim, ngram_range))
+
+    def save(self, index_dir):
+        """
+        每個檔案都先寫到同目錄的暫存檔再 os.replace：其他 worker 正以 mmap 讀取的舊檔不會被截斷，
+        只會在下次 load 時換成新檔。meta 最後寫入，讀到新 meta 時矩陣一定已經就緒。
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        _write_atomic(os.path.join(index_dir, self.MATRIX_FILE), lambda f: np.save(f, self.matrix))
+        _write_atomic(os.path.join(index_dir, self.IDF_FILE), lambda f: np.save(f, self.idf))
+        meta = {
+            "fingerprint": self.fingerprint,
+            "dim": self.vectorizer.dim,
+            "ngram_range": list(self.vectorizer.ngram_range),
+            "size": len(self),
+        }
+        _write_atomic(
+            os.path.join(index_dir, self.META_FILE),
+            lambda f: f.write(json.dumps(meta).encode("utf-8")),
+        )
+
+    @classmethod
+    def load(cls, index_dir, fingerprint=None):
+        """以 mmap 載入索引；若檔案不存在或與目前資料不符則回傳 None"""
+        meta_path = os.path.join(index_dir, cls.META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if fingerprint is not None and meta.get("fingerprint") != fingerprint:
+            return None
+
+        matrix = np.load(os.path.join(index_dir, cls.MATRIX_FILE), mmap_mode="r")
+        idf = np.load(os.path.join(index_dir, cls.IDF_FILE))
+        vectorizer = HashedNgramVectorizer(meta["dim"], tuple(meta["ngram_range"]))
+        return cls(matrix, idf, vectorizer, meta["fingerprint"])
+
+    @classmethod
+    def load_or_build(cls, texts, index_dir, dim=2048, ngram_range=(1, 2)):
+        """優先使用磁碟上的索引，資料有變動時重建；唯讀環境 (如 Vercel) 則只保留在記憶體"""
+        fingerprint = cls.fingerprint_of(texts, dim, ngram_range)
+        try:
+            index = cls.load(index_dir, fingerprint)
+            if index is not None:
+                return index
+        except Exception as e:
+            print(f"[SemanticIndex] 載入索引失敗，改為重建: {e}")
+
+        index = cls.build(texts, dim, ngram_range)
+        if not _is_writable_dir(index_dir):
+            print(f"[SemanticIndex] 索引目錄不可寫入，僅使用記憶體: {index_dir}")
+            return index
+        try:
+            index.save(index_dir)
+        except OSError as e:
+            print(f"[SemanticIndex] 無法寫入索引檔 (僅使用記憶體): {e}")
+        return index
+
+    def search_batch(self, queries, top_k=5):
+        """
+        批次 cosine top-k 查詢。
+        回傳與 queries 等長的清單，每個元素為 [(文件索引, 相似度), ...] (由高到低)。
+        """
+        if not queries or len(self) == 0:
+            return [[] for _ in queries]
+
+        query_matrix = self.vectorizer.transform(queries, self.idf)
+        scores = query_matrix @ self.matrix.T
+        k = min(top_k, scores.shape[1])
+
+        results = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top])]
+            results.append([(int(i), float(row[i])) for i in top])
+        return results
+
+    def search(self, query, top_k=5):
+        return self.search_batch([query], top_k)[0]
@@ -0,0 +1,178 @@
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# --- 對話 Session 設定 (皆可由環境變數調整) ---
+# 閒置超過此秒數的 Session 會被淘汰，前端需重新開始對話
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "1800"))
+# 記憶體模式最多保存的 Session 數量，超過時淘汰最久未使用的
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+# 每個 Session 最多保留的訊息則數 (送進 Prompt 前還會再經過 history_manager 壓縮)
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "40"))
+# memory：單一行程內有效；sqlite：多個 worker / 行程共用同一份對話紀錄
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB = os.getenv("SESSION_DB", "/tmp/littletone_sessions.db")
+
+_SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+IMAGE_PLACEHOLDER = "[附上一張截圖]"
+
+
+def new_session_id():
+    """產生精簡的 Session Token (16 bytes 隨機值，base64url 編碼後 22 字元)"""
+    return secrets.token_urlsafe(16)
+
+
+def is_valid_session_id(session_id):
+    return isinstance(session_id, str) and bool(_SESSION_ID_PATTERN.match(session_id))
+
+
+def turn_messages(user_text, has_image, result):
+    """把一輪對話整理成要存入 Session 的訊息：使用者輸入 + LittleTone 的 reply"""
+    if not isinstance(result, dict) or result.get("analysis") == "Error":
+        # 失敗的回合不保存，使用者重試時不會帶著重複的訊息
+        return []
+    user_content = user_text or ""
+    if has_image:
+        # 截圖本身不保存，只留一個標記讓後續對話知道曾經附圖
+        user_content = f"{IMAGE_PLACEHOLDER} {user_content}".strip()
+    messages = [{"role": "user", "content": user_content}]
+    if result.get("fallback"):
+        # 超時 / 截斷時的在地備援回覆不是模型的回答，只留使用者輸入，下一輪由模型重新接續
+        return messages
+    reply = result.get("reply")
+    if isinstance(reply, str) and reply:
+        assistant = {"role": "assistant", "content": reply}
+        # 一併保存快捷按鈕，下一輪可判斷使用者是否點了按鈕 (見 request_router.is_quick_reply)
+        if isinstance(result.get("suggested_scenarios"), list) and result["suggested_scenarios"]:
+            assistant["suggested_scenarios"] = result["suggested_scenarios"]
+        messages.append(assistant)
+    return messages
+
+
+class MemorySessionStore:
+    """行程內的 Session 儲存：OrderedDict 依最後使用時間排序，同時以數量與 TTL 限制"""
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS, max_sessions=SESSION_MAX_SESSIONS,
+                 max_messages=SESSION_MAX_MESSAGES):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self._sessions = OrderedDict()  # session_id -> (messages, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, session_id, now=None):
+        now = now or time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return list(entry[0])
+
+    def append(self, session_id, messages, now=None):
+        now = now or time.time()
+        with self._lock:
+            self._sweep(now)
+            entry = self._sessions.pop(session_id, None)
+            stored = entry[0] if entry is not None and entry[1] > now else []
+            stored = (stored + list(messages))[-self.max_messages:]
+            self._sessions[session_id] = (stored, now + self.ttl)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _sweep(self, now, limit=8):
+        # 最前面的是最久沒使用的 Session；每次順手清掉幾個已過期的
+        for _ in range(limit):
+            if not self._sessions:
+                return
+            session_id, (_, expires_at) = next(iter(self._sessions.items()))
+            if expires_at > now:
+                return
+            del self._sessions[session_id]
+
+
+class SQLiteSessionStore:
+    """
+    以 SQLite (WAL 模式) 保存 Session，讓多個 worker 共用對話紀錄。
+    append 在一個 IMMEDIATE 交易內完成「讀取 → 接上新訊息 → 截斷 → 寫回」。
+    """
+
+    SWEEP_EVERY = 500
+
+    def __init__(self, db_path=SESSION_DB, ttl=SESSION_TTL_SECONDS, max_messages=SESSION_MAX_MESSAGES):
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._db = sqlite3.connect(db_path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chat_sessions ("
+            "id TEXT PRIMARY KEY, messages TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_expires ON chat_sessions (expires_at)")
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def get(self, session_id, now=None):
+        now = now or time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT messages FROM chat_sessions WHERE id = ? AND expires_at > ?", (session_id, now)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def append(self, session_id, messages, now=None):
+        now = now or time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT messages FROM chat_sessions WHERE id = ? AND expires_at > ?", (session_id, now)
+                ).fetchone()
+                stored = json.loads(row[0]) if row else []
+                stored = (stored + list(messages))[-self.max_messages:]
+                self._db.execute(
+                    "INSERT OR REPLACE INTO chat_sessions (id, messages, expires_at) VALUES (?, ?, ?)",
+                    (session_id, json.dumps(stored, ensure_ascii=False), now + self.ttl),
+                )
+
+                # 定期清掉過期的 Session，讓資料表維持在「近期活躍對話」的數量
+                self._calls += 1
+                if self._calls % self.SWEEP_EVERY == 0:
+                    self._db.execute("DELETE FROM chat_sessions WHERE expires_at <= ?", (now,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def delete(self, session_id):
+        with self._lock:
+            self._db.execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,))
+
+
+def create_session_store(backend=SESSION_BACKEND):
+    if backend == "sqlite":
+        try:
+            return SQLiteSessionStore()
+        except sqlite3.Error as e:
+            print(f"[SessionStore] SQLite 後端啟用失敗，改用記憶體: {e}")
+    return MemorySessionStore()
+
+
+# 全域共用的 Session 儲存
+session_store = create_session_store()
@@ -0,0 +1,68 @@
+import asyncio
+import copy
+import threading
+import weakref
+
+
+class SingleFlight:
+    """
+    合併同時進行中的相同請求：同一個 Key 只會真的執行一次，
+    其餘呼叫端等待同一個結果 (或同一個例外)。
+
+    實際工作跑在獨立的 Task 中，任何一個呼叫端被取消都不會中斷其他人；
+    所有呼叫端都離開後工作仍會完成，讓結果可以寫入快取。
+    """
+
+    def __init__(self):
+        # 依事件迴圈分開保存進行中的 Task (正常情況下只有共用事件迴圈這一個)
+        self._inflight = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._leaders = 0
+        self._followers = 0
+
+    async def run(self, key, factory):
+        """factory 為無參數、回傳 coroutine 的函式；只有第一個呼叫端會真的執行它"""
+        loop = asyncio.get_running_loop()
+        inflight = self._inflight.get(loop)
+        if inflight is None:
+            inflight = self._inflight[loop] = {}
+
+        task = inflight.get(key)
+        is_leader = task is None
+        if is_leader:
+            task = loop.create_task(factory())
+            inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(inflight, key, done))
+        self._count(is_leader)
+
+        # shield：呼叫端被取消時只影響自己，共用的 Task 繼續執行
+        result = await asyncio.shield(task)
+        # 每個呼叫端都拿到獨立的副本，避免多個請求共用同一個可變物件
+        return copy.deepcopy(result)
+
+    def stats(self):
+        with self._lock:
+            total = self._leaders + self._followers
+            return {
+                "upstream_calls": self._leaders,
+                "coalesced": self._followers,
+                "coalesce_rate": round(self._followers / total, 4) if total else 0.0,
+            }
+
+    @staticmethod
+    def _finish(inflight, key, task):
+        inflight.pop(key, None)
+        # 取出例外，避免所有呼叫端都已取消時出現 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def _count(self, is_leader):
+        with self._lock:
+            if is_leader:
+                self._leaders += 1
+            else:
+                self._followers += 1
+
+
+# 全域共用的請求合併器
+single_flight = SingleFlight()
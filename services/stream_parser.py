@@ -0,0 +1,143 @@
+import json
+import re
+
+# 字串結尾若停在不完整的跳脫序列 (\、\u12、或缺少低位代理的 \uD83D)，先保留到下一段再解碼
+_INCOMPLETE_ESCAPE = re.compile(
+    r'(?:\\u[dD][89abAB][0-9a-fA-F]{2}(?:\\u?[0-9a-fA-F]{0,3})?|\\u[0-9a-fA-F]{0,3}|\\)$'
+)
+
+
+class StreamingJSONParser:
+    """
+    逐段解析 GPT 串流輸出的 JSON 物件 (只追蹤最外層欄位)：
+    - 指定要串流的字串欄位 (如 reply)，每收到新字元就回報 ("delta", key, 新增文字)
+    - 其他欄位在值完整結束時回報 ("field", key, 解析後的值)
+    """
+
+    def __init__(self, stream_keys=("reply",)):
+        self.stream_keys = set(stream_keys)
+        self.buffer = ""
+        self._pos = 0
+        self._state = "start"     # start / key / colon / value / after_value / done
+        self._key = None
+        self._key_start = 0
+        self._value_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._emitted = ""
+
+    def feed(self, chunk):
+        """餵入一段新文字，回傳這段文字產生的事件清單"""
+        self.buffer += chunk
+        events = []
+        buf = self.buffer
+
+        while self._pos < len(buf):
+            ch = buf[self._pos]
+            state = self._state
+
+            if state == "start":
+                if ch == "{":
+                    self._state = "key"
+            elif state == "key":
+                if self._in_string:
+                    if self._escape:
+                        self._escape = False
+                    elif ch == "\\":
+                        self._escape = True
+                    elif ch == '"':
+                        self._in_string = False
+                        self._key = json.loads(buf[self._key_start:self._pos + 1])
+                        self._state = "colon"
+                elif ch == '"':
+                    self._in_string = True
+                    self._key_start = self._pos
+                elif ch == "}":
+                    self._state = "done"
+            elif state == "colon":
+                if ch == ":":
+                    self._state = "value"
+                    self._value_start = None
+            elif state == "value":
+                if self._value_start is None:
+                    if ch.isspace():
+                        self._pos += 1
+                        continue
+                    self._value_start = self._pos
+                    self._depth = 0
+                    self._emitted = ""
+                    if ch == '"':
+                        self._in_string = True
+                    elif ch in "{[":
+                        self._depth = 1
+                elif self._in_string:
+                    if self._escape:
+                        self._escape = False
+                    elif ch == "\\":
+                        self._escape = True
+                    elif ch == '"':
+                        self._in_string = False
+                        if self._depth == 0:
+                            events.extend(self._finish_value(self._pos + 1))
+                elif ch == '"':
+                    self._in_string = True
+                elif ch in "{[":
+                    self._depth += 1
+                elif ch in "}]":
+                    if self._depth == 0:
+                        # 純量值之後直接遇到物件結尾
+                        events.extend(self._finish_value(self._pos))
+                        self._state = "done"
+                    else:
+                        self._depth -= 1
+                        if self._depth == 0:
+                            events.extend(self._finish_value(self._pos + 1))
+                elif ch == "," and self._depth == 0:
+                    events.extend(self._finish_value(self._pos))
+                    self._state = "key"
+            elif state == "after_value":
+                if ch == ",":
+                    self._state = "key"
+                elif ch == "}":
+                    self._state = "done"
+            else:
+                break
+
+            self._pos += 1
+
+        # 串流欄位：把目前已收到的字串內容 (扣除不完整跳脫) 以增量方式送出
+        if (self._state == "value" and self._in_string and self._depth == 0
+                and self._value_start is not None and self._key in self.stream_keys):
+            delta = self._string_delta(buf[self._value_start + 1:self._pos])
+            if delta:
+                events.append(("delta", self._key, delta))
+
+        return events
+
+    def _finish_value(self, end):
+        raw = self.buffer[self._value_start:end].strip()
+        if self._state == "value":
+            self._state = "after_value"
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            return []
+
+        events = []
+        if self._key in self.stream_keys and isinstance(value, str):
+            rest = value[len(self._emitted):] if value.startswith(self._emitted) else ""
+            if rest:
+                events.append(("delta", self._key, rest))
+        events.append(("field", self._key, value))
+        return events
+
+    def _string_delta(self, raw):
+        raw = _INCOMPLETE_ESCAPE.sub("", raw)
+        try:
+            text = json.loads(f'"{raw}"')
+        except ValueError:
+            return ""
+        delta = text[len(self._emitted):]
+        self._emitted = text
+        return delta
@@ -0,0 +1,22 @@
+import re
+
+# 本地 Token 估算：不依賴 tiktoken 等額外套件，誤差在一成左右，足以拿來控管預算
+# - 中日韓文字與全形符號：約 1 字 1 token
+# - 英數字詞：約 4 個字元 1 token
+# - 其餘標點 / Emoji：各算 1 token
+_TOKEN_PATTERN = re.compile(
+    r"[\u3000-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]|[A-Za-z0-9_]+|\S"
+)
+
+
+def estimate_tokens(text):
+    """估算一段文字的 Token 數量"""
+    if not text:
+        return 0
+    count = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        if len(piece) > 1:
+            count += (len(piece) + 3) // 4
+        else:
+            count += 1
+    return count
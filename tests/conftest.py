@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 讓測試可直接匯入專案根目錄的 app / services
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,49 @@
+import itertools
+import threading
+
+import pytest
+
+import app as app_module
+from services.event_loop import shared_loop
+
+
+_client_ips = (f"10.2.0.{n}" for n in itertools.count(1))
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+def test_chat_validation_runs_off_the_shared_loop(client, monkeypatch):
+    threads = []
+    original_check = app_module.rate_limiter.check
+
+    def check(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return original_check(*args, **kwargs)
+
+    async def fake_response(user_text, image_base64=None, history=None):
+        threads.append(threading.current_thread())
+        return {"status": "ready", "reply": "好"}
+
+    monkeypatch.setattr(app_module.rate_limiter, "check", check)
+    monkeypatch.setattr(app_module, "get_little_tone_final_response", fake_response)
+    response = client.post("/api/chat", json={"message": "嗨"}, headers={"X-Forwarded-For": "10.1.0.1"})
+    assert response.status_code == 200
+    # 限流在請求執行緒，只有核心服務在共用事件迴圈上執行
+    loop_thread = shared_loop._thread
+    assert threads[0] is not loop_thread and threads[-1] is loop_thread
+
+
+@pytest.mark.parametrize("body", [
+    {"items": "主管說列入參考"},
+    {"items": {"message": "嗨"}},
+    {"tones": "幽默"},
+    {"tones": [""]},
+    {"tones": [42]},
+    {"tones": ["幽默" * 20]},
+])
+def test_batch_rejects_malformed_items_and_tones(client, body):
+    response = client.post("/api/chat/batch", json=body, headers={"X-Forwarded-For": next(_client_ips)})
+    assert response.status_code == 400
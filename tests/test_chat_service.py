@@ -0,0 +1,141 @@
+import asyncio
+import types
+
+import pytest
+
+from services import chat_service
+from services.chat_service import ChatService
+from services.hedging import latency_tracker
+from services.request_router import ROUTES
+from services.session_store import turn_messages
+
+
+class FakeStream:
+    """先送出前半段 JSON，之後一直卡住 (模擬上游在串流途中變慢)"""
+
+    def __init__(self, text):
+        self.text = text
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for start in range(0, len(self.text), 4):
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(
+                delta=types.SimpleNamespace(content=self.text[start:start + 4]))])
+        await asyncio.sleep(60)
+
+
+@pytest.fixture
+def stalled_upstream(monkeypatch):
+    partial = '{"status": "ready", "need_more_info": false, "reply": "先深呼吸，我們一起'
+
+    async def create(**options):
+        return FakeStream(partial)
+
+    fake = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    monkeypatch.setattr(chat_service, "client", fake)
+    monkeypatch.setitem(ROUTES["text_diagnosis"], "latency_budget", 0.3)
+
+
+def _collect(agen):
+    async def run():
+        return [event async for event in agen]
+    return asyncio.run(run())
+
+
+def test_mid_stream_deadline_keeps_sent_reply(stalled_upstream):
+    events = _collect(ChatService.stream_little_tone_response("主管說列入參考，我是不是被拒絕了 (stream test)"))
+    streamed = "".join(event[2] for event in events if event[0] == "delta")
+    kind, result = events[-1]
+    assert kind == "done"
+    assert streamed and result["reply"] == streamed
+    # 尚未收到的欄位由在地備援回覆補齊
+    assert "key_change" in result and "suggested_scenarios" in result
+    assert result["fallback"] == "deadline"
+
+
+def _fake_client(monkeypatch, delays):
+    """依呼叫順序延遲 delays[i] 秒後回傳的上游"""
+    calls = []
+
+    async def create(**options):
+        delay = delays[len(calls)]
+        calls.append(options)
+        await asyncio.sleep(delay)
+        message = types.SimpleNamespace(content='{"status": "ready", "reply": "好"}')
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message, finish_reason="stop")])
+
+    fake = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    monkeypatch.setattr(chat_service, "client", fake)
+    return calls
+
+
+def _hedging_route(monkeypatch, name, delay):
+    route = {**ROUTES["text_diagnosis"], "name": name}
+    monkeypatch.setattr(latency_tracker, "hedge_delay", lambda key: delay)
+    monkeypatch.setattr(latency_tracker, "try_acquire_hedge", lambda: True)
+    return route
+
+
+def test_cancelled_primary_is_recorded_as_lower_bound(monkeypatch):
+    _fake_client(monkeypatch, [10])
+    route = _hedging_route(monkeypatch, "censored_primary_test", None)
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(ChatService._complete(route, []), 0.05)
+
+    asyncio.run(run())
+    samples = list(latency_tracker._samples["censored_primary_test"])
+    assert len(samples) == 1 and samples[0] >= 0.05
+
+
+def test_cancelled_hedge_loser_is_not_a_latency_sample(monkeypatch):
+    # 主要呼叫在對沖送出後不久就完成，落敗的對沖呼叫只跑了一下子，不應拉低 p95
+    calls = _fake_client(monkeypatch, [0.08, 10])
+    route = _hedging_route(monkeypatch, "hedge_loser_test", 0.05)
+    asyncio.run(ChatService._complete(route, []))
+    samples = list(latency_tracker._samples["hedge_loser_test"])
+    assert len(calls) == 2
+    assert len(samples) == 1 and samples[0] >= 0.08
+
+
+def test_failed_upstream_call_is_not_a_latency_sample():
+    route = {"name": "failed_test", "latency_budget": 10}
+    with pytest.raises(ValueError):
+        with ChatService._upstream_timer(route):
+            raise ValueError("bad request")
+    assert "failed_test" not in latency_tracker._samples
+
+
+def test_full_prompt_routes_have_no_output_cap():
+    for name in ("screenshot", "text_diagnosis", "quick_reply"):
+        assert "max_tokens" not in ChatService._completion_options(ROUTES[name], [])
+    assert ChatService._completion_options(ROUTES["tone_rewrite"], [])["max_tokens"] == 400
+
+
+def test_truncated_output_falls_back_and_is_not_cached(monkeypatch):
+    calls = []
+
+    async def create(**options):
+        calls.append(options)
+        message = types.SimpleNamespace(content='{"status": "ready", "reply": "先深呼')
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message, finish_reason="length")])
+
+    fake = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    monkeypatch.setattr(chat_service, "client", fake)
+    text = "主管說列入參考，我是不是被拒絕了 (length test)"
+    for _ in range(2):
+        result = asyncio.run(ChatService.get_little_tone_final_response(text))
+        assert result["status"] == "ready" and result["reply"]
+        assert result["fallback"] == "length"
+    # 截斷的結果沒有寫入快取，第二次仍會呼叫上游
+    assert len(calls) == 2
+
+
+def test_fallback_reply_is_not_stored_as_an_assistant_turn():
+    fallback = ChatService._deadline_fallback("主管說列入參考", [], ROUTES["text_diagnosis"])
+    assert turn_messages("主管說列入參考", False, fallback) == [{"role": "user", "content": "主管說列入參考"}]
+    real = {"status": "ready", "reply": "好"}
+    assert [m["role"] for m in turn_messages("主管說列入參考", False, real)] == ["user", "assistant"]
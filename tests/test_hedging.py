@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from services.hedging import hedged
+
+
+def _attempts(*behaviours):
+    """依序回傳每次 attempt 的行為：(延遲秒數, 結果或例外)"""
+    started = []
+
+    def attempt():
+        delay, outcome = behaviours[len(started)]
+        started.append(delay)
+
+        async def run():
+            await asyncio.sleep(delay)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        return run()
+    return attempt, started
+
+
+def test_primary_failing_before_the_delay_is_not_hedged():
+    attempt, started = _attempts((0.01, RuntimeError("boom")), (0.0, "hedge"))
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(hedged(attempt, delay=0.1))
+    assert len(started) == 1
+
+
+def test_hedge_wins_when_the_slow_primary_fails():
+    attempt, started = _attempts((0.08, RuntimeError("primary")), (0.1, "hedge"))
+    assert asyncio.run(hedged(attempt, delay=0.03)) == ("hedge", "hedge")
+    assert len(started) == 2
+
+
+def test_both_attempts_failing_raises_the_last_error():
+    attempt, started = _attempts((0.05, RuntimeError("primary")), (0.05, RuntimeError("hedge")))
+    with pytest.raises(RuntimeError, match="hedge"):
+        asyncio.run(hedged(attempt, delay=0.02))
+    assert len(started) == 2
+
+
+def test_hedge_is_skipped_when_not_allowed():
+    attempt, started = _attempts((0.05, "primary"), (0.0, "hedge"))
+    assert asyncio.run(hedged(attempt, delay=0.01, may_hedge=lambda: False)) == ("primary", "primary")
+    assert len(started) == 1
@@ -0,0 +1,40 @@
+from services.history_manager import SUMMARY_OMITTED, HistoryManager
+
+
+def _conversation(turns):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"第 {i} 則：我跟主管之間的狀況是這樣的，" + "細節" * 20})
+        history.append({"role": "assistant", "content": f"第 {i} 則回覆：聽起來你很在意這件事，" + "說明" * 20})
+    return history
+
+
+def test_summary_keeps_the_opening_and_trims_the_middle():
+    history = _conversation(12)
+    manager = HistoryManager(token_budget=100, max_messages=2, summary_max_tokens=200)
+    messages, stats = manager.compact(history)
+    summary = messages[0]["content"].splitlines()
+    assert stats["summarized"] > 0
+    # 開頭兩行 (交代事件的最早訊息) 保留，省略標記在中間，最後是最接近原文的訊息
+    assert "第 0 則：" in summary[1] and "第 0 則回覆" in summary[2]
+    assert summary[3] == SUMMARY_OMITTED
+    assert history[stats["summarized"] - 1]["content"][:8] in summary[-1]
+
+
+def test_summary_extension_matches_a_fresh_build():
+    history = _conversation(12)
+    incremental = HistoryManager(token_budget=100, max_messages=2, summary_max_tokens=200)
+    incremental.compact(history[:-4])
+    extended, _ = incremental.compact(history)
+    fresh, _ = HistoryManager(token_budget=100, max_messages=2, summary_max_tokens=200).compact(history)
+    assert extended == fresh
+
+
+def test_non_list_history_is_ignored_without_counting_drops():
+    messages, stats = HistoryManager().compact("abc")
+    assert messages == [] and stats["dropped"] == 0
+
+
+def test_invalid_entries_are_counted_as_dropped():
+    _, stats = HistoryManager().compact([{"role": "user", "content": "嗨"}, "bad", {"role": "tool"}])
+    assert stats["kept"] == 1 and stats["dropped"] == 2
@@ -0,0 +1,91 @@
+import asyncio
+import base64
+import io
+import threading
+
+from PIL import Image, ImageDraw
+
+from services import image_service, metrics
+from services.image_service import ImageService, ScreenshotCache
+
+
+def _screenshot(text="主管說列入參考"):
+    img = Image.new("RGB", (1200, 900), "white")
+    draw = ImageDraw.Draw(img)
+    for row in range(20):
+        draw.text((40, 40 + row * 40), f"{row} {text} {'x' * row}", fill="black")
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def test_cache_hits_and_saved_seconds_are_exported(monkeypatch):
+    monkeypatch.setattr(image_service, "screenshot_cache", ScreenshotCache())
+    hits = metrics.screenshot_cache_total.value(result="hit")
+    misses = metrics.screenshot_cache_total.value(result="miss")
+    saved = metrics.screenshot_cache_saved_seconds_total.value()
+
+    screenshot = _screenshot()
+    assert ImageService.process_screenshot(screenshot)["cache_hit"] is False
+    assert ImageService.process_screenshot(screenshot)["cache_hit"] is True
+
+    assert metrics.screenshot_cache_total.value(result="miss") == misses + 1
+    assert metrics.screenshot_cache_total.value(result="hit") == hits + 1
+    assert metrics.screenshot_cache_saved_seconds_total.value() > saved
+    rendered = metrics.registry.render()
+    assert 'littletone_screenshot_cache_total{result="hit"}' in rendered
+    assert "littletone_screenshot_cache_saved_seconds_total " in rendered
+
+
+def _slow_compress(monkeypatch, started, release):
+    def process_screenshot(base64_str):
+        started.set()
+        release.wait(5)
+        return {"image": base64_str, "digest": "d", "cache_hit": False}
+    monkeypatch.setattr(ImageService, "process_screenshot", staticmethod(process_screenshot))
+
+
+def test_cancelled_waiter_does_not_leak_a_slot(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    _slow_compress(monkeypatch, started, release)
+
+    async def run():
+        slots = image_service._queue_slots(asyncio.get_running_loop())
+        capacity = slots._value
+        holders = [asyncio.ensure_future(ImageService.process_screenshot_async("x")) for _ in range(capacity)]
+        await asyncio.sleep(0.05)
+        waiter = asyncio.ensure_future(ImageService.process_screenshot_async("y", timeout=5))
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        release.set()
+        await asyncio.gather(*holders)
+        await asyncio.sleep(0.05)
+        return capacity, slots._value
+
+    capacity, free = asyncio.run(run())
+    assert free == capacity
+
+
+def test_slot_is_held_until_compression_finishes(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    _slow_compress(monkeypatch, started, release)
+
+    async def run():
+        slots = image_service._queue_slots(asyncio.get_running_loop())
+        capacity = slots._value
+        caller = asyncio.ensure_future(ImageService.process_screenshot_async("x"))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        caller.cancel()
+        await asyncio.sleep(0.05)
+        # 呼叫端已取消，但執行緒池仍在壓縮：名額不能提早歸還
+        held = slots._value
+        release.set()
+        for _ in range(50):
+            if slots._value == capacity:
+                break
+            await asyncio.sleep(0.01)
+        return capacity, held, slots._value
+
+    capacity, held, free = asyncio.run(run())
+    assert held == capacity - 1
+    assert free == capacity
@@ -0,0 +1,18 @@
+import pytest
+
+from services.rag_service import select_social_knowledge
+
+
+@pytest.mark.parametrize("query", ["ok", "hello", "好", "嗯嗯", "哈哈", "thanks", "Hi~"])
+def test_short_or_phatic_input_injects_nothing(query):
+    assert select_social_knowledge(query) == []
+
+
+def test_semantic_only_hits_need_high_similarity():
+    for piece in select_social_knowledge("朋友一直已讀不回，是不是生氣了？"):
+        assert piece["exact_score"] is not None or piece["similarity"] >= 0.5
+
+
+def test_keyword_hit_is_still_injected():
+    pieces = select_social_knowledge("主管說列入參考，我該怎麼回？")
+    assert pieces and pieces[0]["exact_score"] is not None
@@ -0,0 +1,76 @@
+import itertools
+
+import pytest
+
+from services.rate_limiter import MemoryBucketStore, RateLimiter
+
+_client_ips = (f"10.0.0.{n}" for n in itertools.count(1))
+
+
+def test_rules_are_enforced_independently():
+    limiter = RateLimiter(MemoryBucketStore())
+    assert limiter.check("1.2.3.4", "chat")[0]
+    assert limiter.check("1.2.3.4", "chat")[0]
+    assert not limiter.check("1.2.3.4", "chat")[0]
+    # 用完 chat 的額度不影響 stream / batch
+    assert limiter.check("1.2.3.4", "stream")[0]
+    assert limiter.check("1.2.3.4", "batch")[0]
+
+
+def test_alternating_routes_share_one_total_budget():
+    rules = {
+        "chat": {"capacity": 2, "refill_seconds": 60},
+        "stream": {"capacity": 2, "refill_seconds": 60},
+        "upstream": {"capacity": 3, "refill_seconds": 60},
+    }
+    limiter = RateLimiter(MemoryBucketStore(), rules)
+    results = [limiter.check("1.2.3.4", rule)[0] for rule in ("chat", "stream", "chat", "stream")]
+    # 各路由都還有額度，但總量已用完
+    assert results == [True, True, True, False]
+
+
+@pytest.fixture
+def client():
+    from app import app
+    return app.test_client()
+
+
+def _post(client, path, ip):
+    # 空內容會在驗證時回 400，額度用完則在驗證前就回 429
+    return client.post(path, json={}, headers={"X-Forwarded-For": ip}).status_code
+
+
+def test_each_endpoint_has_its_own_bucket(client):
+    ip = next(_client_ips)
+    assert [_post(client, "/api/chat", ip) for _ in range(3)] == [400, 400, 429]
+    assert _post(client, "/api/chat/stream", ip) == 400
+    assert _post(client, "/api/chat/batch", ip) == 400
+
+
+def test_alternating_endpoints_hit_the_shared_limit(client):
+    ip = next(_client_ips)
+    paths = ["/api/chat", "/api/chat/stream"] * 2 + ["/api/chat/batch"] * 7
+    # 預設共用額度 10：chat / stream 各 2 次 + batch 6 次後，batch 自身額度還夠也會被擋
+    assert [_post(client, path, ip) for path in paths] == [400] * 10 + [429]
+
+
+def test_stream_limit_does_not_block_chat(client):
+    ip = next(_client_ips)
+    assert [_post(client, "/api/chat/stream", ip) for _ in range(3)] == [400, 400, 429]
+    assert _post(client, "/api/chat", ip) == 400
+
+
+def test_batch_is_charged_per_item(client, monkeypatch):
+    import app as app_module
+
+    async def fake_batch(messages, image, history=None, context_query=""):
+        for index, _ in enumerate(messages):
+            yield index, {"status": "ready"}
+
+    monkeypatch.setattr(app_module, "stream_batch_responses", fake_batch)
+    ip = next(_client_ips)
+    body = {"items": ["a", "b", "c", "d", "e"], "stream": False}
+    # 預設 batch 額度 10：每批 5 則各扣 1，第三批不足
+    statuses = [client.post("/api/chat/batch", json=body, headers={"X-Forwarded-For": ip}).status_code
+                for _ in range(3)]
+    assert statuses == [200, 200, 429]
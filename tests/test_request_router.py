@@ -0,0 +1,45 @@
+import json
+
+from services.request_router import classify_request
+
+CHIPS = [{"title": "是主管", "example": "對方是我的主管"}, {"title": "[禮貌委婉]", "example": "不好意思，我再確認一下"}]
+
+
+def _history(assistant):
+    return [{"role": "user", "content": "我被念了"}, assistant]
+
+
+def test_long_follow_up_is_not_a_quick_reply():
+    history = _history({"role": "assistant", "content": "怎麼了呢？", "suggested_scenarios": CHIPS})
+    assert classify_request("我男朋友已經三天沒回我訊息了，我該主動找他嗎？", history=history) == "text_diagnosis"
+    assert classify_request("好", history=history) == "text_diagnosis"
+
+
+def test_clicked_chip_is_a_quick_reply():
+    history = _history({"role": "assistant", "content": "對方是誰呢？", "suggested_scenarios": CHIPS})
+    assert classify_request("對方是我的主管", history=history) == "quick_reply"
+    assert classify_request(" 是主管 ", history=history) == "quick_reply"
+
+
+def test_chips_inside_json_content_and_options_key():
+    reply = json.dumps({"reply": "想怎麼做？", "options": [{"title": "想和解", "content": "我希望能道歉並和解"}]},
+                       ensure_ascii=False)
+    assert classify_request("我希望能道歉並和解", history=_history({"role": "assistant", "content": reply})) == "quick_reply"
+
+
+def test_only_the_latest_assistant_turn_counts():
+    history = _history({"role": "assistant", "content": "對方是誰呢？", "suggested_scenarios": CHIPS})
+    history += [{"role": "user", "content": "對方是我的主管"}, {"role": "assistant", "content": "了解"}]
+    assert classify_request("對方是我的主管", history=history) == "text_diagnosis"
+
+
+def test_image_and_tone_rewrite_take_precedence():
+    assert classify_request("是主管", has_image=True) == "screenshot"
+    assert classify_request("(指令：請改成溫柔的語氣)") == "tone_rewrite"
+
+
+def test_session_turns_keep_chips_for_the_next_request():
+    from services.session_store import turn_messages
+
+    history = turn_messages("我被念了", False, {"status": "diagnosing", "reply": "對方是誰呢？", "suggested_scenarios": CHIPS})
+    assert classify_request("是主管", history=history) == "quick_reply"
@@ -0,0 +1,28 @@
+from services.response_cache import ResponseCache
+
+
+def _db_rows(cache):
+    return cache._db.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+def test_sqlite_tier_is_capped(tmp_path):
+    cache = ResponseCache(db_path=str(tmp_path / "cache.db"), db_max_entries=5)
+    cache.SWEEP_EVERY = 4
+    for i in range(12):
+        cache.set(f"key-{i}", {"reply": i})
+    assert _db_rows(cache) <= 5 + cache.SWEEP_EVERY
+    # 留下的是最新寫入的項目
+    cache._entries.clear()
+    assert cache.get("key-11") == {"reply": 11}
+    assert cache.get("key-0") is None
+
+
+def test_sqlite_tier_sweeps_expired_rows(tmp_path):
+    path = str(tmp_path / "cache.db")
+    expired = ResponseCache(ttl=-1, db_path=path)
+    for i in range(3):
+        expired.set(f"old-{i}", {"reply": i})
+    assert _db_rows(expired) == 3
+
+    # 重新啟動時清掉上次留下的過期項目
+    assert _db_rows(ResponseCache(db_path=path)) == 0
@@ -0,0 +1,18 @@
+from services import semantic_index
+from services.semantic_index import SemanticIndex
+
+TEXTS = ["主管說列入參考", "朋友已讀不回", "同事說辛苦了"]
+
+
+def test_index_is_saved_and_reloaded(tmp_path):
+    index_dir = str(tmp_path / "index")
+    built = SemanticIndex.load_or_build(TEXTS, index_dir, dim=256)
+    loaded = SemanticIndex.load(index_dir, built.fingerprint)
+    assert loaded is not None and len(loaded) == len(TEXTS)
+    assert loaded.search_batch(["列入參考"], top_k=1)[0][0][0] == 0
+
+
+def test_read_only_directory_keeps_the_index_in_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(semantic_index.os, "access", lambda path, mode: False)
+    index = SemanticIndex.load_or_build(TEXTS, str(tmp_path / "index"), dim=256)
+    assert len(index) == len(TEXTS) and not (tmp_path / "index").exists()
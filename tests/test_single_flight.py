@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from services.single_flight import SingleFlight
+
+
+def test_error_reaches_every_caller():
+    flight = SingleFlight()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        return await asyncio.gather(*(flight.run("k", failing) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(r, RuntimeError) and str(r) == "upstream down" for r in results)
+
+
+def test_cancelled_caller_does_not_stop_the_shared_work():
+    flight = SingleFlight()
+    finished = []
+
+    async def work():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        return {"reply": "ok"}
+
+    async def run():
+        leader = asyncio.ensure_future(flight.run("k", work))
+        follower = asyncio.ensure_future(flight.run("k", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == {"reply": "ok"}
+    assert finished == [1]
+    assert flight.stats()["upstream_calls"] == 1
+
+
+def test_each_caller_gets_its_own_copy():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        return {"suggested_scenarios": [{"title": "a"}]}
+
+    async def run():
+        return await asyncio.gather(flight.run("k", work), flight.run("k", work))
+
+    first, second = asyncio.run(run())
+    first["suggested_scenarios"].append({"title": "b"})
+    assert second == {"suggested_scenarios": [{"title": "a"}]}
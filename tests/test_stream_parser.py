@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from services.stream_parser import StreamingJSONParser
+
+# reply 內含各種跳脫序列，以及 😀 這種 surrogate pair (😀)
+RAW = ('{"analysis": "a\\\\b", "reply": "說\\"好\\"\\n\\u00e9 \\ud83d\\ude00 ok\\\\", '
+       '"suggested_scenarios": [{"title": "x\\u4e00"}]}')
+EXPECTED = json.loads(RAW)
+
+
+def _parse(chunks):
+    parser = StreamingJSONParser(stream_keys=("reply",))
+    deltas, fields = [], {}
+    for chunk in chunks:
+        for kind, key, value in parser.feed(chunk):
+            if kind == "delta":
+                deltas.append(value)
+            else:
+                fields[key] = value
+    return deltas, fields
+
+
+def _assert_matches(deltas, fields):
+    assert "".join(deltas) == EXPECTED["reply"]
+    # 每一段增量都必須是完整字元，不能送出半個 surrogate 或殘缺的跳脫
+    for delta in deltas:
+        assert not any(0xD800 <= ord(ch) <= 0xDFFF for ch in delta)
+        delta.encode("utf-8")
+    assert fields["analysis"] == EXPECTED["analysis"]
+    assert fields["suggested_scenarios"] == EXPECTED["suggested_scenarios"]
+
+
+@pytest.mark.parametrize("split", range(1, len(RAW)))
+def test_any_chunk_boundary(split):
+    _assert_matches(*_parse([RAW[:split], RAW[split:]]))
+
+
+def test_one_character_at_a_time():
+    _assert_matches(*_parse(RAW))